@@ -1,9 +1,15 @@
-from pymongo import ReplaceOne
+import fcntl
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
 from terminusdb_client import WOQLClient
+from terminusdb_client.errors import DatabaseError, InterfaceError
 from toolz import pluck
 
 from ads_query_eval.config import get_terminus_client, get_terminus_config
-from ads_query_eval.lib.util import hash_of
+from ads_query_eval.lib.util import hash_of, hash_of_json
 
 QUERIES = (
     'full:"coronal mass ejection"',
@@ -90,7 +96,37 @@ QUERY_TOPIC_REVIEWS = {
 }
 
 
-def _bootstrap_db():
+EVALUATING_PROCEDURES = (
+    ("ads_query_eval.frame.evaluators.topic_review_references", "0.1"),
+)
+
+_bootstrapped = False
+_bootstrapped_lock = threading.Lock()
+
+
+def _schema_digest_name(obj: dict) -> str:
+    return "schema:" + obj.get("@id", obj["@type"])
+
+
+def _schema_digests(schema_objects: list) -> dict:
+    # Per schema object, since TerminusDB returns schema objects normalized (e.g.
+    # with defaults filled in), so they cannot be compared with their definitions.
+    return {_schema_digest_name(obj): hash_of_json(obj) for obj in schema_objects}
+
+
+def _changed_schema_objects(schema_objects: list, stored_digests: dict) -> list:
+    """Return the schema objects whose definitions differ from those last applied.
+
+    Classes no longer defined are not deleted, since instances may still use them.
+    """
+    return [
+        obj
+        for obj in schema_objects
+        if stored_digests.get(_schema_digest_name(obj)) != hash_of_json(obj)
+    ]
+
+
+def _bootstrap_db(changed_schema_objects: list):
     config = get_terminus_config()
     _client = WOQLClient(server_url=config["server_url"])
     _client.connect(user="admin", key=config["admin_pass"])
@@ -107,13 +143,23 @@ def _bootstrap_db():
             commit_msg="Adding schema",
             create=True,
         )
-    elif config.get("reset_schema"):
+        return
+    _client.connect(db=config["dbid"], user="admin", key=config["admin_pass"])
+    if config.get("reset_schema"):
         _client.replace_document(
             config["schema_objects"],
             graph_type="schema",
             commit_msg="Resetting schema",
             create=True,
         )
+    elif changed_schema_objects:
+        print(f"updating {len(changed_schema_objects)} schema objects")
+        _client.replace_document(
+            changed_schema_objects,
+            graph_type="schema",
+            commit_msg="Updating schema",
+            create=True,
+        )
 
 
 def _bootstrap_queries():
@@ -140,8 +186,7 @@ def _bootstrap_query_topic_reviews_evaluator():
         (d["fqn"], d["version"])
         for d in client.get_documents_by_type("EvaluatingProcedure")
     }
-    to_ensure = {("ads_query_eval.frame.evaluators.topic_review_references", "0.1")}
-    missing = to_ensure - exists
+    missing = set(EVALUATING_PROCEDURES) - exists
     if missing:
         client.insert_document(
             [
@@ -157,8 +202,88 @@ def _bootstrap_query_topic_reviews_evaluator():
         )
 
 
+def _digests() -> dict:
+    return {
+        **_schema_digests(get_terminus_config()["schema_objects"]),
+        "seed": hash_of_json(
+            {
+                "queries": sorted(QUERIES),
+                "evaluating_procedures": sorted(EVALUATING_PROCEDURES),
+                "query_topic_reviews": QUERY_TOPIC_REVIEWS,
+            }
+        ),
+    }
+
+
+def _stored_digests() -> dict:
+    try:
+        return {
+            d["name"]: d["digest"]
+            for d in get_terminus_client().get_documents_by_type("BootstrapState")
+        }
+    except (InterfaceError, DatabaseError):
+        # No database yet, or one bootstrapped before digests were stored.
+        return {}
+
+
+def _up_to_date(stored: dict, digests: dict) -> bool:
+    # Digests of parts no longer bootstrapped (e.g. removed classes) are ignored.
+    return all(stored.get(name) == digest for name, digest in digests.items())
+
+
+@contextmanager
+def _file_lock(path: Path):
+    with path.open("a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _bootstrap(digests: dict):
+    config = get_terminus_config()
+    stored = _stored_digests()
+    if _up_to_date(stored, digests) and not (
+        config["force_reset_on_init"] or config["reset_schema"]
+    ):
+        return  # bootstrapped by another process while we waited for the lock
+    _bootstrap_db(_changed_schema_objects(config["schema_objects"], stored))
+    if config["force_reset_on_init"] or stored.get("seed") != digests["seed"]:
+        _bootstrap_queries()
+        _bootstrap_query_topic_reviews_evaluator()
+    get_terminus_client().replace_document(
+        [
+            {"@type": "BootstrapState", "name": name, "digest": digest}
+            for name, digest in digests.items()
+        ],
+        commit_msg="Recording bootstrap digests",
+        create=True,
+    )
+
+
 def bootstrap():
-    _bootstrap_db()
-    _bootstrap_queries()
-    _bootstrap_query_topic_reviews_evaluator()
-    print("done bootstrapping")
+    """Ensure the database, its schema and seed documents.
+
+    Runs at most once per process. What was applied is recorded as digests in the
+    database, so when the schema and seed data are unchanged, this is a single read.
+    Otherwise, only what changed is applied, by one process at a time per host.
+    """
+    global _bootstrapped
+    with _bootstrapped_lock:
+        if _bootstrapped:
+            return
+        config = get_terminus_config()
+        digests = _digests()
+        if (
+            config["force_reset_on_init"]
+            or config["reset_schema"]
+            or not _up_to_date(_stored_digests(), digests)
+        ):
+            lock_path = Path(tempfile.gettempdir()) / (
+                f"ads_query_eval_bootstrap.{hash_of(config['dbid'])[:16]}.lock"
+            )
+            with _file_lock(lock_path):
+                _bootstrap(digests)
+            print("done bootstrapping")
+        _bootstrapped = True
@@ -1,34 +1,52 @@
+import csv
+import io
 import json
 from collections import defaultdict
 from email.headerregistry import Address
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+from itertools import islice
 import secrets
 import smtplib
 import ssl
+import time
 from operator import itemgetter
-from typing import List
-from urllib.parse import quote
+from typing import List, Optional
+from urllib.parse import quote, unquote, urlencode
 
 import requests
 from bs4 import BeautifulSoup
 from fastapi import FastAPI, HTTPException, Form, Depends, Request
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
-from jinja2 import Environment, PackageLoader, select_autoescape
 from starlette import status
 from starlette.datastructures import FormData
-from starlette.responses import HTMLResponse, RedirectResponse, JSONResponse
+from starlette.responses import (
+    HTMLResponse,
+    RedirectResponse,
+    JSONResponse,
+    PlainTextResponse,
+    StreamingResponse,
+)
+from starlette.routing import Match
 from terminusdb_client import WOQLQuery as WQ
 from toolz import assoc, groupby
 
 from ads_query_eval.app import bootstrap
+from ads_query_eval.app.rendering import (
+    jinja_env,
+    render_eval_form_items,
+    eval_form_items_are_current,
+)
 from ads_query_eval.config import (
-    get_terminus_client,
+    get_terminus_pool,
     SITE_URL,
     get_smtp_config,
     get_s3_client,
     get_invite_token,
     get_admins,
+    get_auth_config,
+    get_cache_config,
+    get_metrics_config,
 )
 from ads_query_eval.frame import s3
 from ads_query_eval.frame.models import (
@@ -39,17 +57,56 @@ from ads_query_eval.frame.models import (
     Evaluation,
     User,
     RetrievedItemContent,
+    RetrievalSummary,
+)
+from ads_query_eval.lib.io import (
+    find_one,
+    short_id,
+    DocumentLoader,
+    count_retrievals,
+    retrieval_summaries,
+)
+from ads_query_eval.lib.util import (
+    get_password_hash,
+    verify_password,
+    now,
+    hash_of,
+    keyed_digest,
+    sign,
+    unsign,
+    memory_size_of,
+    LRUCache,
 )
-from ads_query_eval.lib.io import find_one
-from ads_query_eval.lib.util import get_password_hash, verify_password, now
+from ads_query_eval.lib import timing
+from ads_query_eval.lib.pool import PoolTimeout
 
-security = HTTPBasic()
+security = HTTPBasic(auto_error=False)
 app = FastAPI()
 
-jinja_env = Environment(
-    loader=PackageLoader("ads_query_eval", "app/templates"),
-    autoescape=select_autoescape(),
+auth_config = get_auth_config()
+# username -> (keyed digest of verified password, or None if only a session token was
+# verified, User document). A password reset drops its entry only in the worker that
+# handles it: other workers accept the old password, and sessions signed with it,
+# until their entries expire (after VERIFIED_USERS_TTL_SECONDS).
+verified_users = LRUCache(
+    maxsize=auth_config["verified_users_maxsize"],
+    ttl=auth_config["verified_users_ttl_seconds"],
 )
+# s3_key -> rendered form fragments of the top-25 items of a retrieval. These are
+# immutable once written by the pipeline, so entries never go stale. Bounded by the
+# (estimated) memory held by the cached items, in bytes.
+eval_form_items = LRUCache(
+    maxsize=get_cache_config()["items_top25_max_bytes"], weigh=memory_size_of
+)
+
+metrics_config = get_metrics_config()
+
+
+def get_terminus_client():
+    # A client is not safe to share between threadpool workers, so each request checks
+    # one out of the pool, and holds it until its response (even a streamed one) is sent.
+    with get_terminus_pool().connection() as client:
+        yield timing.Instrumented(client, "terminus")
 
 
 @app.on_event("startup")
@@ -57,8 +114,31 @@ def _bootstrap():
     bootstrap.bootstrap()
 
 
+@app.exception_handler(PoolTimeout)
+async def pool_timeout_handler(request: Request, exc: PoolTimeout):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Server busy, please retry"},
+        headers={"Retry-After": "5"},
+    )
+
+
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(
+        timing.exposition(
+            caches={
+                "verified_users": verified_users,
+                "eval_form_items": eval_form_items,
+            },
+            pools={"terminus": get_terminus_pool()},
+        ),
+        media_type="text/plain; version=0.0.4",
+    )
+
+
 @app.get("/invite_link/new")
-def new_invite_link(via: str):
+def new_invite_link(via: str, client=Depends(get_terminus_client)):
     if via != get_invite_token():
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -66,7 +146,6 @@ def new_invite_link(via: str):
         )
 
     token = secrets.token_urlsafe()
-    client = get_terminus_client()
     client.insert_document(
         {
             "@type": "InviteLink",
@@ -77,8 +156,7 @@ def new_invite_link(via: str):
 
 
 @app.get("/invite_link/{token}")
-def invite_link(token: str):
-    client = get_terminus_client()
+def invite_link(token: str, client=Depends(get_terminus_client)):
     valid = bool(list(client.query_document({"@type": "InviteLink", "token": token})))
     if not valid:
         raise HTTPException(
@@ -95,9 +173,10 @@ def invite_link(token: str):
 
 @app.post("/credentials_request")
 def credentials_request(
-    email_address: str = Form(...), invite_link_token: str = Form(...)
+    email_address: str = Form(...),
+    invite_link_token: str = Form(...),
+    client=Depends(get_terminus_client),
 ):
-    client = get_terminus_client()
     invite_link_doc = find_one(
         client, {"@type": "InviteLink", "token": invite_link_token}
     )
@@ -120,6 +199,7 @@ def credentials_request(
     if user:
         # If user exists, reset password.
         client.update_document(assoc(user, "hashed_password", hashed_password))
+        verified_users.pop(user["username"])
     else:
         # Otherwise, create new user and set username and password.
         user = {
@@ -157,8 +237,16 @@ def credentials_request(
     )
 
 
-def get_current_username(credentials: HTTPBasicCredentials = Depends(security)):
-    terminus_client = get_terminus_client()
+def _verified_user(
+    credentials: HTTPBasicCredentials, terminus_client
+) -> Optional[dict]:
+    password_digest = keyed_digest(
+        credentials.password or secrets.token_hex(), auth_config["secret_key"]
+    )
+    cached = verified_users.get(credentials.username)
+    if cached and cached[0] and secrets.compare_digest(cached[0], password_digest):
+        return cached[1]
+
     user = find_one(
         terminus_client, {"@type": "User", "username": credentials.username}
     )
@@ -173,17 +261,119 @@ def get_current_username(credentials: HTTPBasicCredentials = Depends(security)):
         credentials.password or secrets.token_hex(), hashed_password
     )
     if not (correct_username and correct_password):
+        return None
+    verified_users.set(username, (password_digest, user))
+    return user
+
+
+def _password_fingerprint(user: dict) -> str:
+    # Bound into session tokens so that a password reset invalidates existing sessions.
+    return hash_of(user["hashed_password"])[:16]
+
+
+def _session_user(token: str, terminus_client) -> Optional[dict]:
+    value = unsign(
+        token, auth_config["secret_key"], max_age=auth_config["session_ttl_seconds"]
+    )
+    if value is None:
+        return None
+    username, _, fingerprint = value.rpartition(":")
+    cached = verified_users.get(username)
+    if cached:
+        user = cached[1]
+    else:
+        user = find_one(terminus_client, {"@type": "User", "username": username})
+        if user:
+            verified_users.set(username, (None, user))
+    if user and secrets.compare_digest(_password_fingerprint(user), fingerprint):
+        return user
+    return None
+
+
+def get_loader(client=Depends(get_terminus_client)) -> DocumentLoader:
+    # FastAPI caches dependency values per request, so all dependents share one loader.
+    return DocumentLoader(client)
+
+
+def get_current_user(
+    request: Request,
+    credentials: Optional[HTTPBasicCredentials] = Depends(security),
+    loader: DocumentLoader = Depends(get_loader),
+) -> User:
+    token = request.cookies.get(auth_config["session_cookie_name"])
+    user = _session_user(token, loader.client) if token else None
+    if user and (credentials is None or credentials.username == user["username"]):
+        loader.prime(user)
+        return User(**user)
+
+    user = _verified_user(credentials, loader.client) if credentials else None
+    if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Basic"},
         )
-    return credentials.username
+    request.state.session_token = sign(
+        f"{user['username']}:{_password_fingerprint(user)}", auth_config["secret_key"]
+    )
+    loader.prime(user)
+    return User(**user)
+
+
+def get_current_username(user: User = Depends(get_current_user)):
+    return user.username
+
+
+@app.middleware("http")
+async def set_session_cookie(request: Request, call_next):
+    response = await call_next(request)
+    token = getattr(request.state, "session_token", None)
+    if token:
+        response.set_cookie(
+            auth_config["session_cookie_name"],
+            token,
+            max_age=auth_config["session_ttl_seconds"],
+            httponly=True,
+            samesite="lax",
+            secure=(SITE_URL or "").startswith("https"),
+        )
+    return response
+
+
+def _route_template(scope) -> str:
+    # Label requests by route template rather than path, to bound the number of series.
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+@app.middleware("http")
+async def record_timings(request: Request, call_next):
+    # Registered last, so outermost: the time includes that of the other middleware.
+    # For streaming responses, it is the time to the start of the response.
+    start = time.perf_counter()
+    status_code = 500
+    with timing.request_timings() as spans:
+        try:
+            response = await call_next(request)
+            status_code = response.status_code
+        finally:
+            elapsed = time.perf_counter() - start
+            timing.request_seconds.observe(
+                elapsed,
+                request.method,
+                _route_template(request.scope),
+                str(status_code),
+            )
+    if metrics_config["server_timing"]:
+        response.headers["Server-Timing"] = timing.server_timing(spans, elapsed)
+    return response
 
 
 @app.get("/")
-def all_queries():
-    client = get_terminus_client()
+def all_queries(client=Depends(get_terminus_client)):
     queries = [Query(**d) for d in client.get_documents_by_type("Query")]
 
     template = jinja_env.get_template("queries.jinja2")
@@ -195,55 +385,58 @@ def all_queries():
 
 
 @app.get("/Query/{query_literal}")
-def query_retrievals(query_literal: str):
-    terminus_client = get_terminus_client()
-    query = list(
-        terminus_client.query_document(
-            {"@type": "Query", "query_literal": query_literal}
-        )
+def query_retrievals(
+    query_literal: str,
+    before: Optional[str] = None,
+    limit: int = 50,
+    terminus_client=Depends(get_terminus_client),
+):
+    query = find_one(
+        terminus_client, {"@type": "Query", "query_literal": query_literal}
     )
     if not query:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="query not found"
         )
-    query = query[0]
     retrievals = [
-        Retrieval(**r)
-        for r in terminus_client.query_document(
-            {"@type": "Retrieval", "query": query["@id"]}
+        RetrievalSummary(**r)
+        for r in retrieval_summaries(
+            terminus_client, query["@id"], before=before, limit=limit
         )
     ]
-    n_retrieved = {}
-    for r in retrievals:
-        n_retrieved[r.id] = len(r.items)
+    n_retrieved = {r.id: r.n_items for r in retrievals}
+    older_retrievals_url = None
+    if len(retrievals) == limit:
+        older_retrievals_url = f"/{query['@id']}?" + urlencode(
+            {"before": retrievals[-1].done_at.isoformat(), "limit": limit}
+        )
     template = jinja_env.get_template("retrievals.jinja2")
     html_content = template.render(
         summary_of_all_query_retrievals=(
-            f"There are {len(retrievals)} completed retrievals of Query {query_literal}."
+            f"There are {count_retrievals(terminus_client, query['@id'])} "
+            f"completed retrievals of Query {query_literal}."
         ),
         query={"query_literal": query_literal},
-        retrievals=sorted(retrievals, key=lambda r: r.done_at, reverse=True),
+        retrievals=retrievals,
         n_retrieved=n_retrieved,
+        older_retrievals_url=older_retrievals_url,
     )
     return HTMLResponse(content=html_content, status_code=200)
 
 
 @app.get("/Retrieval/{retrieval_id}")
-def query_retrieval_evals(retrieval_id: str):
-    terminus_client = get_terminus_client()
-    rdoc = find_one(
-        terminus_client,
-        {"@type": "Retrieval", "s3_key": retrieval_id},
-    )
+def query_retrieval_evals(
+    retrieval_id: str, loader: DocumentLoader = Depends(get_loader)
+):
+    terminus_client = loader.client
+    rdoc = loader.find_retrieval("s3_key", retrieval_id)
     if rdoc is None:
         return HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"retrieval with ID Retrieval/{retrieval_id} not found",
         )
     retrieval = Retrieval(**rdoc)
-    query = Query(
-        **find_one(terminus_client, {"@type": "Query", "@id": retrieval.query})
-    )
+    query = Query(**loader.get(retrieval.query))
     evals = [
         Evaluation(**d)
         for d in terminus_client.query_document(
@@ -264,20 +457,46 @@ def query_retrieval_evals(retrieval_id: str):
     return HTMLResponse(content=html_content, status_code=200)
 
 
+def get_eval_form_items(
+    s3_client, retrieval: Retrieval, loader: DocumentLoader
+) -> List[dict]:
+    items = eval_form_items.get(retrieval.s3_key)
+    if items is not None:
+        return items
+    try:
+        rendered = s3.get_json(
+            client=s3_client, key="eval_form_items__" + retrieval.s3_key
+        )
+    except s3_client.exceptions.NoSuchKey:
+        rendered = None
+    if not eval_form_items_are_current(rendered):
+        # Formatted before fragments were pre-rendered, or with an older template.
+        items_content = [
+            RetrievedItemContent(**c)
+            for c in s3.get_json(
+                client=s3_client, key="items_top25__" + retrieval.s3_key
+            )
+        ]
+        item_ids = [c.retrieved_item for c in items_content]
+        if None in item_ids:
+            # Formatted before item ids were stored with their content.
+            item_ids = loader.get(retrieval.id)["items"]
+        rendered = render_eval_form_items(items_content, item_ids)
+    items = rendered["items"]
+    eval_form_items.set(retrieval.s3_key, items)
+    return items
+
+
 @app.get("/Retrieval/{retrieval_id}/Evaluation")
-def new_evaluation(retrieval_id: str, username: str = Depends(get_current_username)):
+def new_evaluation(
+    retrieval_id: str,
+    user: User = Depends(get_current_user),
+    loader: DocumentLoader = Depends(get_loader),
+):
     s3_client = get_s3_client()
-    terminus_client = get_terminus_client()
-    user = User(**find_one(terminus_client, {"@type": "User", "username": username}))
-    retrieval = Retrieval(
-        **find_one(
-            terminus_client,
-            {"@type": "Retrieval", "s3_key": retrieval_id},
-        )
-    )
-    query = Query(
-        **find_one(terminus_client, {"@type": "Query", "@id": retrieval.query})
-    )
+    terminus_client = loader.client
+    retrieval = Retrieval(**loader.find_retrieval("s3_key", retrieval_id))
+    query = Query(**loader.get(retrieval.query))
     [id_eval] = terminus_client.insert_document(
         {
             "@type": "Evaluation",
@@ -287,43 +506,24 @@ def new_evaluation(retrieval_id: str, username: str = Depends(get_current_userna
             "done": False,
         }
     )
-    items_content = s3.get_json(
-        client=s3_client,
-        key="items_top25__" + retrieval.s3_key,
-    )
-    id_eval = "/".join(id_eval.split("/")[-2:])
-    items_for_evaluation = [
-        {
-            "@type": "ItemOfEvaluation",
-            "evaluation": id_eval,
-            "retrieved_item": i,
-            "retrieved_item_content": RetrievedItemContent(**c),
-        }
-        for i, c in zip(retrieval.items, items_content)
-    ]
-
-    for i in items_for_evaluation:
-        if i["retrieved_item_content"].highlighting is not None:
-            i["highlights"] = sorted(
-                i["retrieved_item_content"].highlighting.items(),
-                key=lambda pair: ("title", "abstract", "body", "ack").index(pair[0]),
-            )
     template = jinja_env.get_template("eval_form.jinja2")
     html_content = template.render(
-        id_eval=id_eval,
+        id_eval=short_id(id_eval),
         query=query,
         retrieval=retrieval,
-        items_for_evaluation=items_for_evaluation,
+        eval_form_items=get_eval_form_items(s3_client, retrieval, loader),
     )
     return HTMLResponse(content=html_content, status_code=200)
 
 
 @app.post("/Evaluation/{eval_id}")
 async def submit_evaluation(
-    request: Request, eval_id: str, username: str = Depends(get_current_username)
+    request: Request,
+    eval_id: str,
+    user: User = Depends(get_current_user),
+    loader: DocumentLoader = Depends(get_loader),
 ):
-    terminus_client = get_terminus_client()
-    user = User(**find_one(terminus_client, {"@type": "User", "username": username}))
+    terminus_client = loader.client
     form_data = await request.form()
     item_eval = defaultdict(dict)
     for k, v in form_data.items():
@@ -331,11 +531,7 @@ async def submit_evaluation(
             _, id_, prop = k.split("/")
             item_eval[id_][prop] = v
 
-    eval = Evaluation(
-        **find_one(
-            terminus_client, {"@type": "Evaluation", "@id": f"Evaluation/{eval_id}"}
-        )
-    )
+    eval = Evaluation(**loader.get(f"Evaluation/{eval_id}"))
     docs = [
         {
             "@type": "ItemOfEvaluation",
@@ -401,40 +597,279 @@ def email_credentials_link(receiver_email: str, one_time_link: str):
         )
 
 
-@app.get("/user_completed_evals/all")
-def get_user_completed_evals(username: str = Depends(get_current_username)):
-    terminus_client = get_terminus_client()
-    user = User(**find_one(terminus_client, {"@type": "User", "username": username}))
-    if user.email_address not in get_admins():
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admins only")
+COMPLETED_EVAL_ITEMS_PAGE_SIZE = 1000
+COMPLETED_EVALUATIONS_PAGE_SIZE = 100
+COMPLETED_EVAL_ITEM_FIELDS = (
+    "evaluation",
+    "done_at",
+    "believed_query_intent",
+    "evaluator",
+    "evaluator_email",
+    "retrieval",
+    "query_literal",
+    "retrieved_item",
+    "ads_bibcode",
+    "relevance",
+    "uncertainty",
+    "evaluation_status",
+)
+
+
+def _completed_eval_items_query():
+    return WQ().woql_and(
+        WQ().triple("v:eval", "type", "@schema:Evaluation"),
+        WQ().read_document("v:eval", "v:eval_doc"),
+        WQ().triple("v:eval", "done", True),
+        WQ().triple("v:eval", "evaluator", "v:evaluator"),
+        WQ().triple("v:evaluator", "type", "@schema:User"),
+        WQ().triple("v:evaluator", "email_address", "v:evaluator_email"),
+        WQ().triple("v:eval", "retrieval", "v:retrieval"),
+        WQ().triple("v:retrieval", "query", "v:query"),
+        WQ().triple("v:query", "query_literal", "v:query_literal"),
+        WQ().triple("v:itemofeval", "evaluation", "v:eval"),
+        WQ().triple("v:itemofeval", "retrieved_item", "v:retrieveditem"),
+        WQ().triple("v:retrieveditem", "retrievable_item", "v:retrievableitem"),
+        WQ().triple("v:retrievableitem", "ads_bibcode", "v:retrieveditem_ads_bibcode"),
+        WQ().read_document("v:itemofeval", "v:itemofeval_doc"),
+    )
+
+
+def _parse_completed_evals_cursor(after: Optional[str]):
+    """A cursor `<done_at>|<n>` follows the completed evaluations done before
+    `done_at`, and the first `n` of those done at `done_at`."""
+    if after is None:
+        return None, 0
+    done_at, _, n = after.rpartition("|")
+    if not done_at or not n.isdigit():
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor"
+        )
+    return done_at, int(n)
+
 
+def _completed_evaluations_page(
+    terminus_client, limit: int, done_at: Optional[str] = None, start: int = 0
+):
+    # Only the evaluations done at or after `done_at` are ordered, before joining
+    # them to anything. Both the filter and the order are the server's comparison
+    # of `done_at`, so pages follow on from their cursor whatever that is; ties are
+    # ordered by id, and those already paged through are skipped by `start`.
+    clauses = [
+        WQ().triple("v:eval", "done_at", "v:done_at"),
+        WQ().triple("v:eval", "type", "@schema:Evaluation"),
+        WQ().triple("v:eval", "done", True),
+    ]
+    if done_at is not None:
+        clauses.insert(
+            1,
+            WQ().woql_not(
+                WQ().less("v:done_at", WQ().literal(done_at, "xsd:dateTime"))
+            ),
+        )
+    query = WQ().limit(limit)
+    if start:
+        query = query.start(start)
     return (
+        query.order_by("v:done_at", "v:eval")
+        .select("v:eval", "v:done_at")
+        .woql_and(*clauses)
+        .execute(terminus_client)
+    )["bindings"]
+
+
+def _enum_value(node: str) -> str:
+    # e.g. "@schema:Relevance/not%20relevant" -> "not relevant"
+    return unquote(node.rpartition("/")[-1])
+
+
+def _completed_eval_item_rows(terminus_client, eval_ids: List[str]) -> dict:
+    """The rows of the items of evaluations, by evaluation id.
+
+    Reads only the fields of the rows, rather than whole documents.
+    """
+    bindings = (
         WQ()
         .woql_and(
-            WQ().triple("v:eval", "type", "@schema:Evaluation"),
-            WQ().read_document("v:eval", "v:eval_doc"),
-            WQ().triple("v:eval", "done", True),
+            WQ().woql_or(*[WQ().eq("v:eval", WQ().iri(e)) for e in eval_ids]),
             WQ().triple("v:eval", "evaluator", "v:evaluator"),
-            WQ().triple("v:evaluator", "type", "@schema:User"),
             WQ().triple("v:evaluator", "email_address", "v:evaluator_email"),
             WQ().triple("v:eval", "retrieval", "v:retrieval"),
             WQ().triple("v:retrieval", "query", "v:query"),
             WQ().triple("v:query", "query_literal", "v:query_literal"),
+            WQ().opt(WQ().triple("v:eval", "done_at", "v:done_at")),
+            WQ().opt(
+                WQ().triple(
+                    "v:eval", "believed_query_intent", "v:believed_query_intent"
+                )
+            ),
             WQ().triple("v:itemofeval", "evaluation", "v:eval"),
             WQ().triple("v:itemofeval", "retrieved_item", "v:retrieveditem"),
-            WQ().triple(
-                "v:retrieveditem", "ads_bibcode", "v:retrieveditem_ads_bibcode"
+            WQ().triple("v:retrieveditem", "retrievable_item", "v:retrievableitem"),
+            WQ().triple("v:retrievableitem", "ads_bibcode", "v:ads_bibcode"),
+            WQ().opt(WQ().triple("v:itemofeval", "relevance", "v:relevance")),
+            WQ().opt(WQ().triple("v:itemofeval", "uncertainty", "v:uncertainty")),
+            WQ().opt(
+                WQ().triple("v:itemofeval", "evaluation_status", "v:evaluation_status")
             ),
-            WQ().read_document("v:itemofeval", "v:itemofeval_doc"),
         )
         .execute(terminus_client)
     )["bindings"]
+    rows = defaultdict(list)
+    for b in sorted(bindings, key=itemgetter("itemofeval")):
+        rows[b["eval"]].append(_completed_eval_item_row(b))
+    return rows
+
+
+def _completed_eval_item_row(binding: dict) -> dict:
+    def value(name):
+        v = binding.get(name)
+        return v["@value"] if isinstance(v, dict) else v
+
+    def enum_value(name):
+        v = binding.get(name)
+        return _enum_value(v) if isinstance(v, str) else None
+
+    return {
+        "evaluation": binding["eval"],
+        "done_at": value("done_at"),
+        "believed_query_intent": value("believed_query_intent"),
+        "evaluator": binding["evaluator"],
+        "evaluator_email": value("evaluator_email"),
+        "retrieval": binding["retrieval"],
+        "query_literal": value("query_literal"),
+        "retrieved_item": binding["retrieveditem"],
+        "ads_bibcode": value("ads_bibcode"),
+        "relevance": enum_value("relevance"),
+        "uncertainty": enum_value("uncertainty"),
+        "evaluation_status": enum_value("evaluation_status"),
+    }
+
+
+def _iter_completed_evaluations(
+    terminus_client, done_at: Optional[str] = None, n: int = 0
+):
+    """Yield the rows of the items of each completed evaluation following the
+    (parsed) cursor `<done_at>|<n>`, with the cursor following that evaluation.
+
+    Pages through evaluations, rather than their items, so that each page orders
+    only evaluations (not their join with their items).
+    """
+    while True:
+        page = _completed_evaluations_page(
+            terminus_client, COMPLETED_EVALUATIONS_PAGE_SIZE, done_at, n
+        )
+        if not page:
+            return
+        rows = _completed_eval_item_rows(terminus_client, [b["eval"] for b in page])
+        for b in page:
+            if b["done_at"]["@value"] == done_at:
+                n += 1
+            else:
+                done_at, n = b["done_at"]["@value"], 1
+            yield f"{done_at}|{n}", rows.get(b["eval"], [])
+        if len(page) < COMPLETED_EVALUATIONS_PAGE_SIZE:
+            return
+
+
+def _iter_completed_eval_items(
+    terminus_client, offset: int = 0, limit: int = None, after: Optional[str] = None
+):
+    # Parsed before streaming, so that an invalid cursor is a bad request.
+    done_at, n = _parse_completed_evals_cursor(after)
+    rows = (
+        row
+        for _, rows in _iter_completed_evaluations(terminus_client, done_at, n)
+        for row in rows
+    )
+    return islice(rows, offset, None if limit is None else offset + limit)
+
+
+def _completed_eval_items_page(
+    terminus_client, limit: int, offset: int = 0, after: Optional[str] = None
+):
+    """The rows of up to `limit` items (after skipping `offset`) of whole completed
+    evaluations following the cursor `after`, and the cursor following them (or
+    None if there are no more).
+
+    A page holds more than `limit` rows only if its one evaluation has more items.
+    """
+    done_at, n = _parse_completed_evals_cursor(after)
+    page = []
+    for cursor, rows in _iter_completed_evaluations(terminus_client, done_at, n):
+        if offset:
+            n_skipped = min(offset, len(rows))
+            rows, offset = rows[n_skipped:], offset - n_skipped
+        if page and len(page) + len(rows) > limit:
+            return page, after
+        page.extend(rows)
+        after = cursor
+    return page, None
+
+
+def _ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(row) + "\n"
+
+
+def _csv_lines(rows):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=COMPLETED_EVAL_ITEM_FIELDS)
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+@app.get("/user_completed_evals/all")
+def get_user_completed_evals(
+    format: str = "json",
+    offset: int = 0,
+    limit: Optional[int] = None,
+    after: Optional[str] = None,
+    user: User = Depends(get_current_user),
+    terminus_client=Depends(get_terminus_client),
+):
+    if user.email_address not in get_admins():
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admins only")
+
+    if format == "json":
+        if limit is None and offset == 0 and after is None:
+            return _completed_eval_items_query().execute(terminus_client)["bindings"]
+        rows, next_after = _completed_eval_items_page(
+            terminus_client,
+            limit or COMPLETED_EVAL_ITEMS_PAGE_SIZE,
+            offset=offset,
+            after=after,
+        )
+        headers = {"X-Next-After": next_after} if next_after is not None else {}
+        return JSONResponse(content=rows, headers=headers)
+
+    rows = _iter_completed_eval_items(
+        terminus_client, offset=offset, limit=limit, after=after
+    )
+    if format == "ndjson":
+        return StreamingResponse(_ndjson_lines(rows), media_type="application/x-ndjson")
+    elif format == "csv":
+        return StreamingResponse(
+            _csv_lines(rows),
+            media_type="text/csv",
+            headers={
+                "Content-Disposition": 'attachment; filename="user_completed_evals.csv"'
+            },
+        )
+    raise HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="format must be one of json, ndjson, csv",
+    )
 
 
 @app.get("/user_completed_evals/summary")
-def get_user_completed_evals(username: str = Depends(get_current_username)):
-    terminus_client = get_terminus_client()
-    user = User(**find_one(terminus_client, {"@type": "User", "username": username}))
+def get_user_completed_evals(
+    user: User = Depends(get_current_user),
+    terminus_client=Depends(get_terminus_client),
+):
     if user.email_address not in get_admins():
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admins only")
 
@@ -453,8 +888,7 @@ def get_user_completed_evals(username: str = Depends(get_current_username)):
 
 
 @app.get("/{cls}/")  # XXX This route must be last!
-def get_documents_by_type(cls: str):
-    terminus_client = get_terminus_client()
+def get_documents_by_type(cls: str, terminus_client=Depends(get_terminus_client)):
     if terminus_client.get_class_frame(cls):
         return terminus_client.get_documents_by_type(cls, as_list=True, count=25)
     return None
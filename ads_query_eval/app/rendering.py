@@ -0,0 +1,78 @@
+"""Templates shared by the app and the pipeline.
+
+The per-item parts of an evaluation form depend only on a retrieval's top items,
+so the pipeline renders them once per retrieval (see `render_eval_form_items`), and
+the app stitches them into the form of each new evaluation.
+"""
+from typing import Dict, List, Optional
+
+from jinja2 import Environment, PackageLoader, Template, select_autoescape
+
+from ads_query_eval.frame.models import RetrievedItemContent
+from ads_query_eval.lib import timing
+from ads_query_eval.lib.util import hash_of
+
+EVAL_FORM_ITEM_TEMPLATE = "item_to_evaluate.jinja2"
+HIGHLIGHT_LOCATIONS = ("title", "abstract", "body", "ack")
+_HIGHLIGHT_ORDER = {location: i for i, location in enumerate(HIGHLIGHT_LOCATIONS)}
+
+
+class TimedTemplate(Template):
+    def render(self, *args, **kwargs) -> str:
+        with timing.span("template", self.name):
+            return super().render(*args, **kwargs)
+
+
+jinja_env = Environment(
+    loader=PackageLoader("ads_query_eval", "app/templates"),
+    autoescape=select_autoescape(),
+)
+jinja_env.template_class = TimedTemplate
+
+
+def template_digest(name: str) -> str:
+    source, _, _ = jinja_env.loader.get_source(jinja_env, name)
+    return hash_of(source)
+
+
+def sorted_highlights(highlighting: Optional[Dict[str, List[str]]]) -> list:
+    return sorted(
+        (highlighting or {}).items(),
+        key=lambda pair: _HIGHLIGHT_ORDER.get(pair[0], len(HIGHLIGHT_LOCATIONS)),
+    )
+
+
+def render_eval_form_items(
+    items_content: List[RetrievedItemContent], item_ids: List[str]
+) -> dict:
+    """Render the form fragment of each item to evaluate.
+
+    The result records the digest of the item template it was rendered with, so
+    that fragments rendered with an older template can be told apart.
+    """
+    template = jinja_env.get_template(EVAL_FORM_ITEM_TEMPLATE)
+    items = []
+    for n_item, (item_id, content) in enumerate(zip(item_ids, items_content), 1):
+        item = {
+            "retrieved_item": item_id,
+            "bibcode": content.bibcode,
+            "highlights": sorted_highlights(content.highlighting),
+        }
+        item["html"] = template.render(
+            n_item=n_item,
+            n_all_items=len(items_content),
+            content=content,
+            bibcode=content.bibcode,
+            item=item,
+        )
+        items.append(item)
+    return {
+        "template_digest": template_digest(EVAL_FORM_ITEM_TEMPLATE),
+        "items": items,
+    }
+
+
+def eval_form_items_are_current(eval_form_items: Optional[dict]) -> bool:
+    return eval_form_items is not None and eval_form_items.get(
+        "template_digest"
+    ) == template_digest(EVAL_FORM_ITEM_TEMPLATE)
@@ -1,12 +1,18 @@
 import json
 from functools import lru_cache
 import os
+import secrets
+import tempfile
+import threading
 from pathlib import Path
 
 import boto3
+import botocore.config
 import requests
+from requests.adapters import HTTPAdapter
 from tenacity import retry, wait_random_exponential
 from terminusdb_client import WOQLClient
+from terminusdb_client.errors import InterfaceError
 
 QUERY_BASE_URL = os.environ.get("ADS_API_QUERY_BASE_URL")
 
@@ -18,6 +24,57 @@ HEADERS = {
 
 SITE_URL = os.environ.get("SITE_URL")
 
+# Number of ADS result pages fetched in parallel by `lib.io.fetch_first_n`.
+ADS_API_MAX_CONCURRENCY = int(os.environ.get("ADS_API_MAX_CONCURRENCY", "5"))
+
+
+@lru_cache
+def get_ads_rate_limit_config():
+    return {
+        # SQLite file shared by every process on this host that calls the ADS API.
+        "path": os.environ.get(
+            "ADS_API_RATE_LIMIT_DB",
+            str(Path(tempfile.gettempdir()) / "ads_query_eval_ratelimit.sqlite3"),
+        ),
+        "rate": float(os.environ.get("ADS_API_RATE_PER_SECOND", "5")),
+        "burst": int(os.environ.get("ADS_API_RATE_BURST", "10")),
+    }
+
+
+@lru_cache
+def get_ads_cache_config():
+    return {
+        "path": os.environ.get(
+            "ADS_API_CACHE_DB",
+            str(Path(tempfile.gettempdir()) / "ads_query_eval_cache.sqlite3"),
+        ),
+        "max_bytes": int(
+            os.environ.get("ADS_API_CACHE_MAX_BYTES", str(512 * 1024**2))
+        ),
+        # TTLs in seconds, per kind of query. 0 disables caching for that kind.
+        # Lookups of a single bibcode (e.g. topic reviews' references) rarely change.
+        "ttl_bibcode": float(
+            os.environ.get("ADS_API_CACHE_TTL_BIBCODE", str(7 * 86400))
+        ),
+        # Opt-in: pages of search results are large, and would evict the bibcode
+        # lookups from the cache's shared size budget.
+        "ttl_search": float(os.environ.get("ADS_API_CACHE_TTL_SEARCH", "0")),
+    }
+
+
+@lru_cache
+def get_ads_session() -> requests.Session:
+    # `requests.Session` pools connections via urllib3, which is safe to share across threads
+    # for plain GETs, so one session (and its TLS connections) serves all concurrent page fetches.
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=1, pool_maxsize=max(ADS_API_MAX_CONCURRENCY, 1)
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update(HEADERS)
+    return session
+
 
 @lru_cache
 def get_terminus_config():
@@ -29,6 +86,7 @@ def get_terminus_config():
         "dbid": os.environ.get("TERMINUSDB_DBID", "ads-query-eval"),
         "schema_objects": schema_objects,
         "force_reset_on_init": os.environ.get("TERMINUSDB_FORCE_RESET"),
+        "reset_schema": os.environ.get("TERMINUSDB_RESET_SCHEMA"),
     }
 
     @retry(wait=wait_random_exponential(multiplier=1, max=60))
@@ -40,14 +98,30 @@ def get_terminus_config():
     return _config
 
 
-@lru_cache
 def get_terminus_client() -> WOQLClient:
+    # Not cached: a client keeps per-connection state and is not safe to share between
+    # threads. Concurrent code checks clients out of `get_terminus_pool()` instead.
     config = get_terminus_config()
     _client = WOQLClient(server_url=config["server_url"])
     _client.connect(db=config["dbid"], user="admin", key=config["admin_pass"])
     return _client
 
 
+@lru_cache
+def get_terminus_pool():
+    # Imported here: `ads_query_eval.lib` imports this module.
+    from ads_query_eval.lib.pool import ClientPool
+
+    return ClientPool(
+        get_terminus_client,
+        maxsize=int(os.getenv("TERMINUS_POOL_SIZE", "16")),
+        name="terminus",
+        timeout=float(os.getenv("TERMINUS_POOL_TIMEOUT_SECONDS", "30")),
+        check=WOQLClient.info,
+        broken_by=(requests.ConnectionError, InterfaceError),
+    )
+
+
 @lru_cache
 def get_smtp_config():
     return {
@@ -68,23 +142,103 @@ def get_s3_config():
         "s3_endpoint_url": os.getenv("S3_ENDPOINT_URL"),
         "s3_bucket": os.getenv("S3_BUCKET"),
         "s3_prefix": os.getenv("S3_PREFIX"),
+        # codec for `frame.s3.put_json` bodies: "gzip" (default), "zstd", or "identity".
+        "s3_json_codec": os.getenv("S3_JSON_CODEC", "gzip"),
+        # Threads per multipart transfer, see `frame.s3.TRANSFER_CONFIG`.
+        "s3_transfer_max_concurrency": int(
+            os.getenv("S3_TRANSFER_MAX_CONCURRENCY", "4")
+        ),
+        "s3_max_pool_connections": int(os.getenv("S3_MAX_POOL_CONNECTIONS", "16")),
     }
 
 
-def get_s3_client():
-    # not using @lru_cache because:
-    # "Session objects are not thread safe and should not be shared across threads and processes"
+@lru_cache
+def get_s3_client_config() -> botocore.config.Config:
     _conf = get_s3_config()
-    session = boto3.session.Session()
-    return session.client(
-        "s3",
-        region_name=_conf["s3_region_name"],
-        endpoint_url=_conf["s3_endpoint_url"],
-        aws_access_key_id=_conf["s3_access_key_id"],
-        aws_secret_access_key=_conf["s3_secret_access_key"],
+    return botocore.config.Config(
+        # Enough connections for a multipart transfer's threads, plus other requests.
+        max_pool_connections=max(
+            _conf["s3_max_pool_connections"], _conf["s3_transfer_max_concurrency"]
+        ),
+        retries={"max_attempts": 5, "mode": "standard"},
+        tcp_keepalive=True,
     )
 
 
+_s3_clients = threading.local()
+
+
+def get_s3_client():
+    # Not @lru_cache'd: "Session objects are not thread safe and should not be shared
+    # across threads and processes". So each thread of each process makes its own
+    # session and client once, and reuses the client (and its connection pool) after.
+    pid = os.getpid()
+    if getattr(_s3_clients, "pid", None) != pid:
+        _conf = get_s3_config()
+        session = boto3.session.Session()
+        _s3_clients.client = session.client(
+            "s3",
+            region_name=_conf["s3_region_name"],
+            endpoint_url=_conf["s3_endpoint_url"],
+            aws_access_key_id=_conf["s3_access_key_id"],
+            aws_secret_access_key=_conf["s3_secret_access_key"],
+            config=get_s3_client_config(),
+        )
+        _s3_clients.pid = pid
+    return _s3_clients.client
+
+
+@lru_cache
+def get_auth_config():
+    return {
+        # Without a configured SECRET_KEY, sessions are only valid for this process' lifetime.
+        "secret_key": os.getenv("SECRET_KEY") or secrets.token_urlsafe(),
+        "session_cookie_name": "ads_query_eval_session",
+        "session_ttl_seconds": int(os.getenv("SESSION_TTL_SECONDS", "3600")),
+        # Also how long other workers keep accepting a user's password, and sessions,
+        # after it is reset.
+        "verified_users_ttl_seconds": int(
+            os.getenv("VERIFIED_USERS_TTL_SECONDS", "300")
+        ),
+        "verified_users_maxsize": int(os.getenv("VERIFIED_USERS_MAXSIZE", "1024")),
+    }
+
+
+@lru_cache
+def get_cache_config():
+    return {
+        # Of memory held by the rendered eval form items cached, as estimated from
+        # the sizes of their Python objects.
+        "items_top25_max_bytes": int(
+            os.getenv("ITEMS_TOP25_CACHE_MAX_BYTES", str(64 * 1024 * 1024))
+        ),
+    }
+
+
+@lru_cache
+def get_metrics_config():
+    return {
+        # Whether responses report where their time went in a `Server-Timing` header.
+        # Off by default, since it reveals backend timings to clients.
+        "server_timing": os.getenv("SERVER_TIMING", "false").lower()
+        == "true",
+    }
+
+
+@lru_cache
+def get_history_config():
+    return {
+        # Where the Parquet retrieval-history dataset is stored in S3, under the
+        # configured S3 prefix, and mirrored locally for memory-mapped reads.
+        "s3_prefix": os.getenv("HISTORY_S3_PREFIX", "history/"),
+        "local_dir": os.getenv(
+            "HISTORY_LOCAL_DIR",
+            str(Path(tempfile.gettempdir()) / "ads_query_eval_history"),
+        ),
+        "compression": os.getenv("HISTORY_PARQUET_COMPRESSION", "zstd"),
+    }
+
+
 @lru_cache
 def get_invite_token():
     return os.getenv("INVITE_TOKEN")
@@ -1,6 +1,12 @@
 import json
-import pickle
+import os
+import re
+import tempfile
+import time
 from datetime import date, datetime
+from io import TextIOWrapper
+from pathlib import Path
+from urllib.parse import quote
 from zoneinfo import ZoneInfo
 
 from dagster import (
@@ -13,20 +19,45 @@ from dagster import (
     Failure,
     graph,
     ScheduleDefinition,
+    DynamicOut,
+    DynamicOutput,
+    Field,
+    multiprocess_executor,
 )
 from toolz import assoc, merge
 from terminusdb_client import WOQLQuery as WQ
 
 from ads_query_eval.app.bootstrap import bootstrap
-from ads_query_eval.config import get_s3_client, get_terminus_client
-from ads_query_eval.frame.models import Retrieval
-from ads_query_eval.lib.io import fetch_first_n, find_one
+from ads_query_eval.app.rendering import render_eval_form_items
+from ads_query_eval.config import get_s3_client, get_terminus_pool
+from ads_query_eval.frame.models import Retrieval, RetrievedItemContent
+from ads_query_eval.lib.io import (
+    descending,
+    fetch_first_n,
+    find_one,
+    find_retrieval,
+    short_id,
+    digest_of_responses,
+    write_retrieved_items,
+)
 
 from ads_query_eval.frame import s3
-from ads_query_eval.lib.io import fetch_first_page
-from ads_query_eval.lib.util import now, today_as_str
+from ads_query_eval.frame.history import (
+    append_history,
+    history_config,
+    partition_key,
+    previous_partition_key,
+    ranked_bibcodes,
+)
+from ads_query_eval.frame.rankdiff import rank_diff
+from ads_query_eval.frame.evaluators import references_by_query, relevant_as_reference
+from ads_query_eval.frame.metrics import update_evaluation_metrics
+from ads_query_eval.frame.migrations import migrate_retrievable_items
+from ads_query_eval.lib.util import hash_of, import_via_dotted_path, now, today_as_str
 
-bootstrap()
+# How many per-query retrieval steps of the daily fan-out may run at once.
+RETRIEVAL_MAX_CONCURRENCY = int(os.environ.get("RETRIEVAL_MAX_CONCURRENCY", "4"))
+RETRIEVED_ITEMS_CHUNK_SIZE = int(os.environ.get("RETRIEVED_ITEMS_CHUNK_SIZE", "100"))
 
 
 @resource
@@ -36,22 +67,114 @@ def s3_resource():
 
 @resource
 def terminus_resource():
-    return get_terminus_client()
-
+    # Bootstrapping here rather than at import keeps code-location loads fast.
+    bootstrap()
+    # Held for the step (or, in-process, the run), then checked back in for reuse.
+    with get_terminus_pool().connection() as client:
+        yield client
+
+
+def _to_json(o):
+    if isinstance(o, datetime):
+        return {"__datetime__": o.isoformat()}
+    elif isinstance(o, date):
+        return {"__date__": o.isoformat()}
+    elif isinstance(o, (set, frozenset)):
+        return {"__set__": list(o)}
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+def _from_json(d):
+    if len(d) == 1:
+        if "__datetime__" in d:
+            return datetime.fromisoformat(d["__datetime__"])
+        elif "__date__" in d:
+            return date.fromisoformat(d["__date__"])
+        elif "__set__" in d:
+            return set(d["__set__"])
+    return d
+
+
+class S3JSONIOManager(IOManager):
+    """Stores op outputs in S3 as compressed JSON, with a local-disk read-through tier.
+
+    Outputs are encoded straight into a compressed file in `cache_dir`, which is then
+    uploaded with a multipart transfer; inputs are read from that file if present, and
+    otherwise downloaded to it first. Besides JSON types, datetimes, dates and sets
+    round-trip; tuples come back as lists.
+    """
+
+    def __init__(self, cache_dir: str, codec: str, max_age_days: float):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.codec = codec
+        self.max_age_days = max_age_days
+
+    def _key_and_path(self, context):
+        key = "__".join(context.get_identifier()) + ".json"
+        return key, self.cache_dir / quote(key, safe="")
+
+    def _evict_stale(self):
+        cutoff = time.time() - self.max_age_days * 86400
+        for path in self.cache_dir.iterdir():
+            # Another process may evict (or replace) the same file concurrently.
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def _tmp_path(self, path: Path) -> Path:
+        # Unique per writer (process or thread), so that concurrent writers of the
+        # same output never write to the same file.
+        fd, name = tempfile.mkstemp(
+            dir=self.cache_dir, prefix=path.name + ".", suffix=".tmp"
+        )
+        os.close(fd)
+        return Path(name)
 
-class S3PickleIOManager(IOManager):
     def handle_output(self, context, obj):
-        key = "__".join(context.get_identifier())
-        s3.put(client=get_s3_client(), key=key, body=pickle.dumps(obj))
+        key, path = self._key_and_path(context)
+        tmp_path = self._tmp_path(path)
+        try:
+            with tmp_path.open("wb") as f:
+                with TextIOWrapper(
+                    s3.compressing_writer(f, self.codec), encoding="utf-8"
+                ) as w:
+                    json.dump(obj, w, default=_to_json)
+            tmp_path.replace(path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        s3.upload_file(client=get_s3_client(), key=key, path=str(path))
+        self._evict_stale()
 
     def load_input(self, context):
-        key = "__".join(context.get_identifier())
-        return pickle.loads(s3.get(client=get_s3_client(), key=key).read())
-
-
-@io_manager
-def s3_pickle_io_manager():
-    return S3PickleIOManager()
+        key, path = self._key_and_path(context)
+        if not path.exists():
+            tmp_path = self._tmp_path(path)
+            try:
+                s3.download_file(client=get_s3_client(), key=key, path=str(tmp_path))
+                tmp_path.replace(path)
+            except BaseException:
+                tmp_path.unlink(missing_ok=True)
+                raise
+        with path.open("rb") as f, s3.decoded(f) as r:
+            return json.load(r, object_hook=_from_json)
+
+
+@io_manager(
+    config_schema={
+        "cache_dir": Field(
+            str,
+            default_value=str(Path(tempfile.gettempdir()) / "ads_query_eval_io"),
+        ),
+        "codec": Field(str, default_value=s3.s3_config["s3_json_codec"]),
+        "max_age_days": Field(float, default_value=7.0),
+    }
+)
+def s3_json_io_manager(init_context):
+    return S3JSONIOManager(**init_context.resource_config)
 
 
 @op(required_resource_keys={"db"})
@@ -60,202 +183,251 @@ def inject_topic_review_analysis(context: OpExecutionContext, query_analysis):
         d["query"]: d["bibcodes"]
         for d in context.resources.db.query_topic_reviews.find()
     }
+    references = references_by_query(
+        {q: query_topic_reviews[q] for q in query_analysis}
+    )
     for q, a in query_analysis.items():
         context.log.info(f"{q}: {len(a['returned'])}")
-        if "topic_review_info" not in a:
-            a["topic_review_info"] = []
-        for q_bibcode in query_topic_reviews[q]:
-            print(f"fetching {q_bibcode} for {q}")
-            a["topic_review_info"].append(fetch_first_page(q_bibcode))
-    for q, a in query_analysis.items():
-        a["relevant_bibcodes"] = set()
-        for response in a["topic_review_info"]:
-            a["relevant_bibcodes"] |= set(response["response"]["docs"][0]["reference"])
-        a["relevant_bibcodes"] = list(a["relevant_bibcodes"])
-    for q, a in query_analysis.items():
-        for doc in a["returned"]:
-            doc_bibcodes = set()
-            doc_bibcodes.add(doc["bibcode"])
-            doc_bibcodes |= set(
-                doc["identifier"]
-            )  # non-bibcodes don't affect intersection check below.
-            doc["_relevant_as_topic_review_ref"] = bool(
-                doc_bibcodes & set(a["relevant_bibcodes"])
-            )
+        a["relevant_bibcodes"] = list(references[q])
+        for doc, relevant in zip(
+            a["returned"], relevant_as_reference(a["returned"], references[q])
+        ):
+            doc["_relevant_as_topic_review_ref"] = relevant
     return {"payload": query_analysis, "name": "query_analysis"}
 
 
-def query_literal_to_dagster_name(s):
-    return (
-        s.replace(":", "_")
-        .replace('"', "_")
-        .replace(" ", "_")
-        .replace("(", "_")
-        .replace(")", "_")
-        .replace(".", "_")
-        .replace(",", "_")
+@op(required_resource_keys={"terminus"})
+def evaluation_metrics_op(context: OpExecutionContext):
+    terminus_client = context.resources.terminus
+    procedure = find_one(
+        terminus_client,
+        {
+            "@type": "EvaluatingProcedure",
+            "fqn": "ads_query_eval.frame.evaluators.topic_review_references",
+        },
+    )
+    n_updated = update_evaluation_metrics(
+        terminus_client,
+        reference_bibcodes=references_by_query((procedure or {}).get("config", {})),
+        logger=context.log,
     )
+    context.log.info(f"updated metrics for {n_updated} evaluations")
 
 
-@repository
-def default():
-    client = get_terminus_client()
-    queries = client.get_documents_by_type("Query", as_list=True)
+@graph()
+def evaluation_metrics():
+    evaluation_metrics_op()
+
 
-    @op(
-        config_schema={"query_literal": str, "date": str},
-        required_resource_keys={"s3", "terminus"},
+@op(required_resource_keys={"terminus"})
+def migrate_retrievable_items_op(context: OpExecutionContext):
+    n_migrated = migrate_retrievable_items(
+        context.resources.terminus, logger=context.log
     )
-    def retrieval_op(context: OpExecutionContext):
-        need_to_format_retrieval = True
-        s3_client, terminus_client = context.resources.s3, context.resources.terminus
-        query_literal = context.op_config["query_literal"]
-        q = next(
-            terminus_client.query_document(
-                {"@type": "Query", "query_literal": query_literal}
-            ),
-            None,
-        )
-        if q is None:
-            raise Failure(f"No Query with query_literal {query_literal} found!")
+    context.log.info(f"migrated {n_migrated} retrieved items")
 
-        # get earlier date from config, else today
-        today_str = today_as_str(tz=ZoneInfo("America/New_York"))
-        date_str_from_config = context.op_config.get("date")
-        if date_str_from_config:
-            try:
-                date.fromisoformat(date_str_from_config)
-                if date_str_from_config > today_str:
-                    raise Failure(
-                        f"date given as config, '{date_str_from_config}', is in the future"
-                    )
-                yyyy_mm_dd = date_str_from_config
-            except ValueError:
+
+@graph()
+def retrievable_items_migration():
+    migrate_retrievable_items_op()
+
+
+def query_literal_to_dagster_name(s):
+    # Dagster names and mapping keys must match ^[A-Za-z0-9_]+$. Suffix a digest
+    # so that literals differing only in punctuation still map to distinct names.
+    return re.sub(r"[^A-Za-z0-9_]", "_", s) + "_" + hash_of(s)[:8]
+
+
+@op(required_resource_keys={"s3", "terminus"})
+def retrieval_op(context: OpExecutionContext, query_spec):
+    need_to_format_retrieval = True
+    s3_client, terminus_client = context.resources.s3, context.resources.terminus
+    query_literal = query_spec["query_literal"]
+    q = next(
+        terminus_client.query_document(
+            {"@type": "Query", "query_literal": query_literal}
+        ),
+        None,
+    )
+    if q is None:
+        raise Failure(f"No Query with query_literal {query_literal} found!")
+
+    # get earlier date from config, else today
+    today_str = today_as_str(tz=ZoneInfo("America/New_York"))
+    date_str_from_config = query_spec.get("date")
+    if date_str_from_config:
+        try:
+            date.fromisoformat(date_str_from_config)
+            if date_str_from_config > today_str:
                 raise Failure(
-                    f"date given as config, '{date_str_from_config}', is invalid."
+                    f"date given as config, '{date_str_from_config}', is in the future"
                 )
-        else:
-            yyyy_mm_dd = today_str
+            yyyy_mm_dd = date_str_from_config
+        except ValueError:
+            raise Failure(
+                f"date given as config, '{date_str_from_config}', is invalid."
+            )
+    else:
+        yyyy_mm_dd = today_str
 
-        key = f"{query_literal}.{yyyy_mm_dd}.json.gz"
-        completed_retrieval = find_one(
-            terminus_client,
-            {"@type": "Retrieval", "s3_key": key, "status": "completed"},
+    key = f"{query_literal}.{yyyy_mm_dd}.json.gz"
+    completed_retrieval = find_one(
+        terminus_client,
+        {"@type": "Retrieval", "s3_key": key, "status": "completed"},
+    )
+    n_to_retrieve = 1000
+    size = None
+    if completed_retrieval:
+        context.log.info(f"Found metadata record for retrieval {key}")
+        try:
+            responses = s3.get_json(client=s3_client, key=key)
+            content_digest = digest_of_responses(responses)
+            context.log.info(f"Found retrieval data for {key}")
+        except Exception as e:
+            context.log.info(f"Exception info: {e}")
+            context.log.info(f"Retrieval data for {key} not found. Will fetch.")
+            responses = fetch_first_n(
+                q=query_literal, n=n_to_retrieve, logger=context.log
+            )
+            content_digest = digest_of_responses(responses)
+            size = s3.put_json(
+                client=s3_client,
+                key=key,
+                body=responses,
+                metadata={"content-digest": content_digest},
+            )
+            context.log.info(f"Put {key} to S3")
+        retrieval_id = completed_retrieval["@id"]
+    else:
+        context.log.info(
+            f"Did not find metadata record for retrieval {key}. Checking for already-fetched data."
         )
-        n_to_retrieve = 1000
-        if completed_retrieval:
-            context.log.info(f"Found metadata record for retrieval {key}")
-            try:
-                responses = s3.get_json(client=s3_client, key=key)
-                context.log.info(f"Found retrieval data for {key}")
-            except Exception as e:
-                context.log.info(f"Exception info: {e}")
-                context.log.info(f"Retrieval data for {key} not found. Will fetch.")
-                responses = fetch_first_n(
-                    q=query_literal, n=n_to_retrieve, logger=context.log
-                )
-                s3.put_json(client=s3_client, key=key, body=responses)
-                context.log.info(f"Put {key} to S3")
-            retrieval_id = completed_retrieval["@id"]
-        else:
-            context.log.info(
-                f"Did not find metadata record for retrieval {key}. Checking for already-fetched data."
+        metadata_backfill = False
+        try:
+            responses = s3.get_json(client=s3_client, key=key)
+            context.log.info(f"Found retrieval data for {key}")
+            metadata_backfill = True
+        except Exception as e:
+            context.log.info(f"Exception info: {e}")
+            context.log.info(f"Retrieval data for {key} not found. Will fetch.")
+            responses = fetch_first_n(
+                q=query_literal, n=n_to_retrieve, logger=context.log
             )
-            metadata_backfill = False
-            try:
-                responses = s3.get_json(client=s3_client, key=key)
-                context.log.info(f"Found retrieval data for {key}")
-                metadata_backfill = True
-            except Exception as e:
-                context.log.info(f"Exception info: {e}")
-                context.log.info(f"Retrieval data for {key} not found. Will fetch.")
-                responses = fetch_first_n(
-                    q=query_literal, n=n_to_retrieve, logger=context.log
-                )
 
-            assigned_status = "completed"
-            # TODO: save retrieval, then add another job step to take status to either
-            #  'published' or 'unpublished' (along with (optional) 'reason' enum value 'same_as_prev').
-            if not metadata_backfill:
-                # Same as last retrieval? Then save status:aborted retrieval and do not persist data in S3.
-                bindings = (
-                    WQ()
-                    .limit(1)
-                    .order_by("v:done_at", order="desc")
-                    .woql_and(
-                        WQ().triple("v:retrieval", "type", "@schema:Retrieval"),
-                        WQ().triple("v:retrieval", "query", q["@id"]),
-                        WQ().triple("v:retrieval", "done_at", "v:done_at"),
-                        WQ().triple("v:retrieval", "s3_key", "v:s3_key"),
-                    )
-                    .execute(terminus_client)["bindings"]
+        content_digest = digest_of_responses(responses)
+        assigned_status = "completed"
+        # TODO: save retrieval, then add another job step to take status to either
+        #  'published' or 'unpublished' (along with (optional) 'reason' enum value 'same_as_prev').
+        if not metadata_backfill:
+            # Same as last retrieval? Then save status:aborted retrieval and do not persist data in S3.
+            bindings = (
+                WQ()
+                .limit(1)
+                .order_by(descending("v:done_at"))
+                .woql_and(
+                    WQ().triple("v:retrieval", "query", q["@id"]),
+                    WQ().triple("v:retrieval", "type", "@schema:Retrieval"),
+                    WQ().triple("v:retrieval", "done_at", "v:done_at"),
+                    WQ().triple("v:retrieval", "s3_key", "v:s3_key"),
+                    WQ().opt(
+                        WQ().triple("v:retrieval", "content_digest", "v:content_digest")
+                    ),
                 )
-                if bindings:
-                    last_retrieval_metadata = bindings[0]
-                    try:
-                        last_retrieval_responses = s3.get_json(
-                            client=s3_client,
-                            key=last_retrieval_metadata["s3_key"]["@value"],
-                        )
-                        assigned_status = (
-                            "aborted"
-                            if (
-                                json.dumps(responses, sort_keys=True)
-                                == json.dumps(last_retrieval_responses, sort_keys=True)
+                .execute(terminus_client)["bindings"]
+            )
+            if bindings:
+                last_retrieval_metadata = bindings[0]
+                try:
+                    last_content_digest = (
+                        last_retrieval_metadata.get("content_digest") or {}
+                    ).get("@value")
+                    if last_content_digest is None:
+                        # Retrieval recorded before digests were stored.
+                        last_content_digest = digest_of_responses(
+                            s3.get_json(
+                                client=s3_client,
+                                key=last_retrieval_metadata["s3_key"]["@value"],
                             )
-                            else "completed"
                         )
+                    assigned_status = (
+                        "aborted"
+                        if content_digest == last_content_digest
+                        else "completed"
+                    )
 
-                    except Exception as e:
-                        context.log.info(f"Exception info: {e}")
-
-            if assigned_status == "completed" and not metadata_backfill:
-                s3.put_json(client=s3_client, key=key, body=responses)
-                context.log.info(f"Put {key} to S3")
-            doc = {
-                "@type": "Retrieval",
-                "query": q["@id"],
-                "s3_key": key,
-                "status": assigned_status,
-                "items": [],
-            }
-            if assigned_status == "completed":
-                doc = merge(
-                    doc,
-                    {
-                        "done": "true",
-                        "done_at": (
-                            now()
-                            if not metadata_backfill
-                            else datetime.fromisoformat(yyyy_mm_dd)
-                        ),
-                    },
-                )
-            [retrieval_id] = terminus_client.insert_document(doc)
-            need_to_format_retrieval = assigned_status == "completed"
+                except Exception as e:
+                    context.log.info(f"Exception info: {e}")
 
-        return {
-            "retrieval": retrieval_id,
-            "query_literal": query_literal,
-            "responses": responses,
-            "need_to_format_retrieval": need_to_format_retrieval,
+        if assigned_status == "completed" and not metadata_backfill:
+            size = s3.put_json(
+                client=s3_client,
+                key=key,
+                body=responses,
+                metadata={"content-digest": content_digest},
+            )
+            context.log.info(f"Put {key} to S3")
+        doc = {
+            "@type": "Retrieval",
+            "query": q["@id"],
+            "s3_key": key,
+            "status": assigned_status,
+            "items": [],
+            "content_digest": content_digest,
+        }
+        if assigned_status == "completed":
+            doc = merge(
+                doc,
+                {
+                    "done": "true",
+                    "done_at": (
+                        now()
+                        if not metadata_backfill
+                        else datetime.fromisoformat(yyyy_mm_dd)
+                    ),
+                },
+            )
+        [retrieval_id] = terminus_client.insert_document(doc)
+        need_to_format_retrieval = assigned_status == "completed"
+
+    # Pass a claim check for the responses, already stored in S3, rather than the
+    # responses themselves: downstream ops fetch them only if and when needed.
+    responses_ref = None
+    if need_to_format_retrieval:
+        responses_ref = {
+            "key": key,
+            "content_digest": content_digest,
+            "size": size if size is not None else s3.size_of(s3_client, key),
         }
+    return {
+        "retrieval": retrieval_id,
+        "query_literal": query_literal,
+        "date": yyyy_mm_dd,
+        "responses_ref": responses_ref,
+        "need_to_format_retrieval": need_to_format_retrieval,
+    }
+
 
-    @op(
-        required_resource_keys={"terminus", "s3"},
+@op(
+    required_resource_keys={"terminus", "s3"},
+)
+def format_query_retrieval_for_evaluation(
+    context: OpExecutionContext, retrieval_op_out
+):
+    if not retrieval_op_out["need_to_format_retrieval"]:
+        context.log.info("no need to format retrieval")
+        return
+
+    s3_client, terminus_client = context.resources.s3, context.resources.terminus
+    query_literal = retrieval_op_out["query_literal"]
+    responses_ref = retrieval_op_out["responses_ref"]
+    context.log.info(
+        f"reading {responses_ref['size']} bytes of responses from {responses_ref['key']}"
     )
-    def format_query_retrieval_for_evaluation(
-        context: OpExecutionContext, retrieval_op_out
-    ):
-        if not retrieval_op_out["need_to_format_retrieval"]:
-            context.log.info("no need to format retrieval")
-            return
-
-        s3_client, terminus_client = context.resources.s3, context.resources.terminus
-        query_literal = retrieval_op_out["query_literal"]
-        responses = retrieval_op_out["responses"]
-        formatted_items = []
-        context.log.info("formatting items")
+    formatted_items = []
+
+    def formatting(responses):
+        # Format each page as it is parsed and digested, rather than first parsing
+        # all of them.
         for r in responses:
             highlighting = r["highlighting"]
             q = r["responseHeader"]["params"]["q"]
@@ -272,73 +444,311 @@ def default():
                     dwh["highlighting"] = h_for_doc
                 docs_with_highlighting.append(dwh)
             formatted_items.extend(docs_with_highlighting)
+            yield r
+
+    context.log.info("formatting items")
+    responses = s3.iter_json(client=s3_client, key=responses_ref["key"])
+    if digest_of_responses(formatting(responses)) != responses_ref["content_digest"]:
+        raise Failure(f"content of {responses_ref['key']} changed since retrieval")
+
+    retrieval_id = short_id(retrieval_op_out["retrieval"])
+    _retrieval_doc = find_retrieval(terminus_client, retrieval_id)
+    context.log.info("writing retrieved items")
+    item_ids = write_retrieved_items(
+        terminus_client,
+        retrieval_id,
+        [item["bibcode"] for item in formatted_items],
+        chunk_size=RETRIEVED_ITEMS_CHUNK_SIZE,
+        logger=context.log,
+    )
+    context.log.info("updating retrieval with items")
+    terminus_client.replace_document(
+        merge(_retrieval_doc, {"items": item_ids, "n_items": len(item_ids)}),
+        commit_msg="updating retrieval with items",
+    )
+    # Keep the item ids with their content, so that consumers of the S3 payloads
+    # need not read the retrieval's `items` list.
+    formatted_items = [
+        assoc(item, "retrieved_item", item_id)
+        for item, item_id in zip(formatted_items, item_ids)
+    ]
+    _retrieval = Retrieval(**_retrieval_doc)
+    s3.put_json(
+        client=s3_client,
+        key="items_all__" + _retrieval.s3_key,
+        body=formatted_items,
+    )
+    s3.put_json(
+        client=s3_client,
+        key="items_top25__" + _retrieval.s3_key,
+        body=formatted_items[:25],
+    )
+    return {
+        "retrieval": retrieval_id,
+        "query_literal": query_literal,
+        "date": retrieval_op_out["date"],
+        "s3_key": _retrieval.s3_key,
+    }
+
+
+@op(required_resource_keys={"s3"})
+def render_evaluation_form_items(context: OpExecutionContext, formatted_retrieval):
+    if formatted_retrieval is None:
+        context.log.info("no formatted retrieval to render evaluation form items for")
+        return
+
+    s3_client = context.resources.s3
+    s3_key = formatted_retrieval["s3_key"]
+    items_content = [
+        RetrievedItemContent(**c)
+        for c in s3.get_json(client=s3_client, key="items_top25__" + s3_key)
+    ]
+    rendered = render_eval_form_items(
+        items_content, [c.retrieved_item for c in items_content]
+    )
+    s3.put_json(client=s3_client, key="eval_form_items__" + s3_key, body=rendered)
+    context.log.info(f"rendered {len(rendered['items'])} evaluation form items")
 
-        _retrieval_doc = find_one(
+
+@op(
+    required_resource_keys={"terminus", "s3"},
+)
+def evaluate_retrieval_by_procedures(context: OpExecutionContext, formatted_retrieval):
+    if formatted_retrieval is None:
+        context.log.info("no formatted retrieval to evaluate")
+        return
+
+    s3_client, terminus_client = context.resources.s3, context.resources.terminus
+    retrieval_id = formatted_retrieval["retrieval"]
+    docs = item_ids = None
+    for procedure in terminus_client.get_documents_by_type("EvaluatingProcedure"):
+        # Only a completed evaluation counts: one left "in progress" (by a run before
+        # evaluations were written in a single commit) is evaluated afresh.
+        if find_one(
             terminus_client,
-            {"@type": "Retrieval", "@id": retrieval_op_out["retrieval"]},
+            {
+                "@type": "Evaluation",
+                "retrieval": retrieval_id,
+                "evaluator": procedure["@id"],
+                "status": "completed",
+            },
+        ):
+            continue
+        if docs is None:
+            docs = s3.get_json(
+                client=s3_client, key="items_all__" + formatted_retrieval["s3_key"]
+            )
+            item_ids = [d.get("retrieved_item") for d in docs]
+            if None in item_ids:
+                # Formatted before item ids were stored with their content.
+                item_ids = find_one(
+                    terminus_client, {"@type": "Retrieval", "@id": retrieval_id}
+                )["items"]
+        context.log.info(f"evaluating with {procedure['fqn']} v{procedure['version']}")
+        evaluator = import_via_dotted_path(procedure["fqn"])
+        relevances = evaluator(
+            procedure["config"], formatted_retrieval["query_literal"], docs
         )
-        context.log.info("updating retrieval with items")
+        # The evaluation and its items are written in one commit, under an id derived
+        # from the retrieval and procedure, so that a rerun after a failed or racing
+        # write replaces rather than duplicates it.
+        id_eval = "Evaluation/" + hash_of(f"{retrieval_id}|{procedure['@id']}")
         terminus_client.replace_document(
-            assoc(
-                _retrieval_doc,
-                "items",
-                [
-                    {
-                        "@type": "RetrievedItem",
-                        "ads_bibcode": item["bibcode"],
-                        "retrieval": retrieval_op_out["retrieval"],
-                    }
-                    for item in formatted_items
-                ],
-            ),
-            commit_msg="updating retrieval with items",
+            [
+                {
+                    "@type": "ItemOfEvaluation",
+                    "evaluation": id_eval,
+                    "retrieved_item": item_id,
+                    "relevance": relevance,
+                    "uncertainty": "not supplied",
+                    "evaluation_status": "done",
+                }
+                for item_id, relevance in zip(item_ids, relevances)
+            ]
+            + [
+                {
+                    "@type": "Evaluation",
+                    "@id": id_eval,
+                    "done": "true",
+                    "status": "completed",
+                    "done_at": now(),
+                    "evaluator": procedure["@id"],
+                    "retrieval": retrieval_id,
+                }
+            ],
+            create=True,
+            commit_msg=f"evaluating retrieval by {procedure['fqn']}",
         )
-        _retrieval = Retrieval(**_retrieval_doc)
-        s3.put_json(
-            client=s3_client,
-            key="items_all__" + _retrieval.s3_key,
-            body=formatted_items,
+
+
+@op(
+    config_schema={
+        "query_literals": Field(
+            [str],
+            default_value=[],
+            description="Queries to retrieve. Default: all Query documents.",
+        ),
+        "date": Field(str, default_value="", description="YYYY-MM-DD. Default: today."),
+    },
+    required_resource_keys={"terminus"},
+    out=DynamicOut(),
+)
+def fan_out_queries(context: OpExecutionContext):
+    query_literals = context.op_config["query_literals"] or [
+        q["query_literal"]
+        for q in context.resources.terminus.get_documents_by_type("Query")
+    ]
+    context.log.info(f"fanning out retrieval of {len(query_literals)} queries")
+    for query_literal in query_literals:
+        yield DynamicOutput(
+            {"query_literal": query_literal, "date": context.op_config["date"]},
+            mapping_key=query_literal_to_dagster_name(query_literal),
+        )
+
+
+@op(required_resource_keys={"s3"})
+def append_retrieval_history(context: OpExecutionContext, formatted_retrieval):
+    if formatted_retrieval is None:
+        context.log.info("no formatted retrieval to append to history")
+        return
+
+    s3_client = context.resources.s3
+    items = s3.get_json(
+        client=s3_client, key="items_all__" + formatted_retrieval["s3_key"]
+    )
+    key = append_history(
+        s3_client,
+        formatted_retrieval["query_literal"],
+        formatted_retrieval["date"],
+        items,
+    )
+    context.log.info(f"wrote {len(items)} rows of history to {key}")
+    return key
+
+
+@op(required_resource_keys={"s3"})
+def diff_retrieval_ranks(context: OpExecutionContext, formatted_retrieval, history_key):
+    if formatted_retrieval is None:
+        context.log.info("no formatted retrieval to diff")
+        return
+
+    s3_client = context.resources.s3
+    query_literal = formatted_retrieval["query_literal"]
+    previous_key = previous_partition_key(
+        s3_client, query_literal, formatted_retrieval["date"]
+    )
+    if previous_key is None:
+        context.log.info(f"no previous retrieval of {query_literal} to diff against")
+        return
+    diff = merge(
+        {
+            "query_literal": query_literal,
+            "date": formatted_retrieval["date"],
+            "previous_history_key": previous_key,
+        },
+        rank_diff(
+            ranked_bibcodes(s3_client, previous_key),
+            ranked_bibcodes(s3_client, history_key),
+        ),
+    )
+    s3.put_json(
+        client=s3_client,
+        key="rank_diff__" + formatted_retrieval["s3_key"],
+        body=diff,
+    )
+    context.log.info(
+        f"kendall tau {diff['kendall_tau']}, rbo {diff['rank_biased_overlap']}, "
+        f"{len(diff['top25']['entered'])} entered top 25"
+    )
+
+
+def retrieve_and_evaluate(query_spec):
+    formatted_retrieval = format_query_retrieval_for_evaluation(
+        retrieval_op(query_spec)
+    )
+    render_evaluation_form_items(formatted_retrieval)
+    diff_retrieval_ranks(
+        formatted_retrieval, append_retrieval_history(formatted_retrieval)
+    )
+    return evaluate_retrieval_by_procedures(formatted_retrieval)
+
+
+@graph()
+def retrieval():
+    fan_out_queries().map(retrieve_and_evaluate)
+
+
+@op(required_resource_keys={"s3"})
+def backfill_retrieval_history_op(context: OpExecutionContext):
+    s3_client = context.resources.s3
+    existing = {key for key, _ in s3.list_keys(s3_client, history_config["s3_prefix"])}
+    n_appended = 0
+    for key, _ in s3.list_keys(s3_client, "items_all__"):
+        # keys are `items_all__{query_literal}.{yyyy-mm-dd}.json.gz`
+        query_literal, _, yyyy_mm_dd = key[
+            len("items_all__") : -len(".json.gz")
+        ].rpartition(".")
+        if partition_key(query_literal, yyyy_mm_dd) in existing:
+            continue
+        append_history(
+            s3_client, query_literal, yyyy_mm_dd, s3.get_json(s3_client, key)
         )
-        s3.put_json(
-            client=s3_client,
-            key="items_top25__" + _retrieval.s3_key,
-            body=formatted_items[:25],
+        n_appended += 1
+    context.log.info(f"appended {n_appended} retrievals to history")
+
+
+@graph()
+def retrieval_history_backfill():
+    backfill_retrieval_history_op()
+
+
+@repository
+def default():
+    retrieval_job = retrieval.to_job(
+        name="retrieval",
+        resource_defs={
+            "s3": s3_resource,
+            "terminus": terminus_resource,
+            "io_manager": s3_json_io_manager,
+        },
+        executor_def=multiprocess_executor.configured(
+            {"max_concurrent": RETRIEVAL_MAX_CONCURRENCY}
+        ),
+    )
+    jobs = [retrieval_job]
+    schedule_jobs = [
+        ScheduleDefinition(
+            name="daily__retrieval",
+            job=retrieval_job,
+            cron_schedule="0 10 * * *",
+            execution_timezone="America/New_York",
         )
+    ]
 
-    @graph()
-    def retrieval():
-        format_query_retrieval_for_evaluation(retrieval_op())
-
-    jobs = []
-    schedule_jobs = []
-    for i, q in enumerate(queries):
-        job_name = "retrieval__" + query_literal_to_dagster_name(q["query_literal"])
-        job = retrieval.to_job(
-            name=job_name,
-            resource_defs={"s3": s3_resource, "terminus": terminus_resource},
-            config={
-                "ops": {
-                    "retrieval_op": {
-                        "config": {"query_literal": q["query_literal"], "date": ""}
-                    }
-                }
-            },
+    evaluation_metrics_job = evaluation_metrics.to_job(
+        name="evaluation_metrics", resource_defs={"terminus": terminus_resource}
+    )
+    jobs.append(evaluation_metrics_job)
+    schedule_jobs.append(
+        ScheduleDefinition(
+            name="daily__evaluation_metrics",
+            job=evaluation_metrics_job,
+            cron_schedule="0 4 * * *",
+            execution_timezone="America/New_York",
         )
-        jobs.append(job)
-        starthour = 10
-        minutes_spacing = 2
-        minutes_after_hour, hours_after_starthour = ((minutes_spacing * i) % 60), (
-            (minutes_spacing * i) // 60
+    )
+
+    jobs.append(
+        retrievable_items_migration.to_job(
+            name="retrievable_items_migration",
+            resource_defs={"terminus": terminus_resource},
         )
-        hours_after_midnight = starthour + hours_after_starthour
-        assert hours_after_midnight < 24, "need to revisit job scheduling"
-        schedule_jobs.append(
-            ScheduleDefinition(
-                name="daily__" + job.name,
-                job=job,
-                cron_schedule=f"{minutes_after_hour} {hours_after_midnight} * * *",
-                execution_timezone="America/New_York",
-            )
+    )
+
+    jobs.append(
+        retrieval_history_backfill.to_job(
+            name="retrieval_history_backfill", resource_defs={"s3": s3_resource}
         )
+    )
 
     return [jobs + schedule_jobs]
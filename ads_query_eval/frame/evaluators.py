@@ -0,0 +1,59 @@
+"""Automated evaluators, registered as `EvaluatingProcedure` documents by their dotted path.
+
+Each evaluator is called as `evaluator(config, query_literal, docs)`, where `config` is the
+procedure's stored config and `docs` are the retrieved ADS documents in rank order, and
+returns one `Relevance` value ("relevant" or "not relevant") per doc.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, FrozenSet, Iterable, List
+
+from ads_query_eval.config import ADS_API_MAX_CONCURRENCY
+from ads_query_eval.lib.io import fetch_first_page
+
+
+def review_references(review_q: str) -> FrozenSet[str]:
+    # Not memoized in-process: `ads_get` caches `bibcode:` queries on disk for
+    # ADS_API_CACHE_TTL_BIBCODE, so updated reviews are seen once that expires.
+    docs = fetch_first_page(review_q)["response"]["docs"]
+    return frozenset(docs[0].get("reference", [])) if docs else frozenset()
+
+
+def fetch_review_references(review_qs: Iterable[str]) -> Dict[str, FrozenSet[str]]:
+    review_qs = sorted(set(review_qs))
+    if not review_qs:
+        return {}
+    with ThreadPoolExecutor(
+        max_workers=min(ADS_API_MAX_CONCURRENCY, len(review_qs))
+    ) as executor:
+        return dict(zip(review_qs, executor.map(review_references, review_qs)))
+
+
+def references_by_query(config: Dict[str, List[str]]) -> Dict[str, FrozenSet[str]]:
+    # Fetch each distinct review once, concurrently, even if several queries share it.
+    references = fetch_review_references(
+        review_q for review_qs in config.values() for review_q in review_qs
+    )
+    return {
+        query_literal: frozenset().union(*(references[r] for r in review_qs))
+        for query_literal, review_qs in config.items()
+    }
+
+
+def relevant_as_reference(docs: List[dict], index: FrozenSet[str]) -> List[bool]:
+    # `identifier` lists a doc's alternate bibcodes, DOIs, arXiv IDs etc.;
+    # non-bibcodes simply never match the index.
+    return [
+        doc["bibcode"] in index or not index.isdisjoint(doc.get("identifier", ()))
+        for doc in docs
+    ]
+
+
+def topic_review_references(
+    config: Dict[str, List[str]], query_literal: str, docs: List[dict]
+) -> List[str]:
+    review_qs = config.get(query_literal, [])
+    index = frozenset().union(*fetch_review_references(review_qs).values())
+    return [
+        "relevant" if relevant else "not relevant"
+        for relevant in relevant_as_reference(docs, index)
+    ]
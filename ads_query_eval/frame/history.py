@@ -0,0 +1,153 @@
+"""Columnar history of retrievals: one row per retrieved item per retrieval.
+
+Each formatted retrieval is appended to a Parquet dataset in S3, partitioned
+Hive-style by query literal and date (`query=<quoted literal>/date=<yyyy-mm-dd>/`).
+`sync_history` mirrors the dataset locally, and `history_dataset` / `read_history`
+read the local copy with memory-mapped files, e.g.
+
+    sync_history(get_s3_client())
+    df = read_history(query_literal='full:"solar wind"', since="2022-01-01").to_pandas()
+"""
+import io
+from pathlib import Path
+from typing import List, Optional
+from urllib.parse import quote
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from mypy_boto3_s3.client import S3Client
+from pyarrow.fs import LocalFileSystem
+
+from ads_query_eval.config import get_history_config
+from ads_query_eval.frame import s3
+
+history_config = get_history_config()
+
+ITEM_SCHEMA = pa.schema(
+    [
+        ("rank", pa.int32()),
+        ("bibcode", pa.string()),
+        ("citation_count", pa.int64()),
+        ("citation_count_norm", pa.float64()),
+        ("read_count", pa.int64()),
+        ("doctype", pa.string()),
+        ("pubdate", pa.string()),
+    ]
+)
+PARTITIONING = ds.partitioning(
+    pa.schema([("query", pa.string()), ("date", pa.string())]), flavor="hive"
+)
+
+
+def partition_key(query_literal: str, yyyy_mm_dd: str) -> str:
+    return (
+        f"{history_config['s3_prefix']}query={quote(query_literal, safe='')}"
+        f"/date={yyyy_mm_dd}/part-0.parquet"
+    )
+
+
+def history_table(items: List[dict]) -> pa.Table:
+    """Tabulate formatted retrieval items (as stored in `items_all__` objects)."""
+    return pa.Table.from_pydict(
+        {
+            "rank": list(range(len(items))),
+            **{
+                name: [item.get(name) for item in items]
+                for name in ITEM_SCHEMA.names
+                if name != "rank"
+            },
+        },
+        schema=ITEM_SCHEMA,
+    )
+
+
+def append_history(
+    client: S3Client, query_literal: str, yyyy_mm_dd: str, items: List[dict]
+) -> str:
+    """Write the partition for a retrieval of `query_literal` on `yyyy_mm_dd`,
+    replacing any earlier one (so re-running a retrieval is idempotent)."""
+    buffer = io.BytesIO()
+    pq.write_table(
+        history_table(items), buffer, compression=history_config["compression"]
+    )
+    key = partition_key(query_literal, yyyy_mm_dd)
+    s3.put(client, key, buffer.getvalue())
+    return key
+
+
+def previous_partition_key(
+    client: S3Client, query_literal: str, yyyy_mm_dd: str
+) -> Optional[str]:
+    """Return the key of the latest partition for `query_literal` before `yyyy_mm_dd`."""
+    query_prefix = partition_key(query_literal, "").rpartition("date=")[0]
+    earlier = [
+        key
+        for key, _ in s3.list_keys(client, query_prefix)
+        if key[len(query_prefix) :] < f"date={yyyy_mm_dd}"
+    ]
+    return max(earlier) if earlier else None
+
+
+def read_partition(client: S3Client, key: str, columns: List[str] = None) -> pa.Table:
+    return pq.read_table(s3.get(client, key), columns=columns)
+
+
+def ranked_bibcodes(client: S3Client, key: str) -> List[str]:
+    """Return the bibcodes of a history partition in rank order."""
+    table = read_partition(client, key, columns=["rank", "bibcode"])
+    return table.sort_by("rank").column("bibcode").to_pylist()
+
+
+def sync_history(client: S3Client, local_dir: str = None, logger=None) -> Path:
+    """Download partitions that are missing, or changed in size, to `local_dir`."""
+    local_dir = Path(local_dir or history_config["local_dir"])
+    n_downloaded = 0
+    for key, size in s3.list_keys(client, history_config["s3_prefix"]):
+        path = local_dir / key[len(history_config["s3_prefix"]) :]
+        if path.exists() and path.stat().st_size == size:
+            continue
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Dot-prefixed files are ignored by dataset discovery while downloading.
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        s3.download_file(client, key, str(tmp_path))
+        tmp_path.replace(path)
+        n_downloaded += 1
+    if logger:
+        logger.info(f"downloaded {n_downloaded} history partitions to {local_dir}")
+    return local_dir
+
+
+def history_dataset(local_dir: str = None) -> ds.Dataset:
+    """Open the local copy of the history dataset, reading files memory-mapped."""
+    return ds.dataset(
+        str(Path(local_dir or history_config["local_dir"])),
+        format="parquet",
+        partitioning=PARTITIONING,
+        filesystem=LocalFileSystem(use_mmap=True),
+    )
+
+
+def read_history(
+    query_literal: str = None,
+    since: str = None,
+    until: str = None,
+    columns: Optional[List[str]] = None,
+    local_dir: str = None,
+) -> pa.Table:
+    """Read history rows, optionally for one query and/or an inclusive date range.
+
+    Filters on `query` and `date` prune whole partitions, so only matching files are
+    touched. Call `.to_pandas()` on the result for a DataFrame.
+    """
+    filters = []
+    if query_literal is not None:
+        filters.append(ds.field("query") == query_literal)
+    if since is not None:
+        filters.append(ds.field("date") >= since)
+    if until is not None:
+        filters.append(ds.field("date") <= until)
+    expression = None
+    for f in filters:
+        expression = f if expression is None else expression & f
+    return history_dataset(local_dir).to_table(columns=columns, filter=expression)
@@ -0,0 +1,233 @@
+from collections import defaultdict
+from typing import Dict, Iterable, List
+
+import numpy as np
+from terminusdb_client import WOQLClient, WOQLQuery as WQ
+
+from ads_query_eval.lib.io import retrieved_item_ids
+from ads_query_eval.lib.util import hash_of_json
+
+DEPTH = 1000
+METRIC_FIELDS = ("p_at_25", "r_at_1000", "mrr", "ndcg_at_25")
+
+
+def precision_at_k(rel: np.ndarray, k: int) -> np.ndarray:
+    return rel[:, :k].sum(axis=1) / k
+
+
+def recall_at_k(rel: np.ndarray, n_relevant: np.ndarray, k: int) -> np.ndarray:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(n_relevant > 0, rel[:, :k].sum(axis=1) / n_relevant, np.nan)
+
+
+def reciprocal_rank(rel: np.ndarray) -> np.ndarray:
+    first_relevant = rel.argmax(axis=1)
+    return np.where(rel.any(axis=1), 1.0 / (first_relevant + 1), 0.0)
+
+
+def ndcg_at_k(rel: np.ndarray, n_relevant: np.ndarray, k: int) -> np.ndarray:
+    discounts = 1.0 / np.log2(np.arange(2, k + 2))
+    dcg = rel[:, :k] @ discounts
+    ideal_dcg = np.concatenate([[0.0], np.cumsum(discounts)])[np.minimum(n_relevant, k)]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(ideal_dcg > 0, dcg / ideal_dcg, np.nan)
+
+
+def judgment_matrix(
+    evaluations: List[dict],
+    retrievals: Dict[str, dict],
+    retrieved_items: Dict[str, str],
+    items_of_evaluation: Iterable[dict],
+    reference_bibcodes: Dict[str, Iterable[str]] = None,
+    query_literals: Dict[str, str] = None,
+    depth: int = DEPTH,
+):
+    """Build a dense (evaluation x rank) relevance matrix.
+
+    Each row is an evaluation of one retrieval of one query; `rel[e, k]` is 1 if the
+    item at rank `k` of that retrieval was judged relevant in evaluation `e`.
+    `n_relevant[e]` is the size of the pooled relevant set for the row's query: every
+    bibcode judged relevant in any evaluation of the query, plus any topic-review
+    `reference_bibcodes` (keyed by query literal).
+    """
+    row_of = {e["@id"]: row for row, e in enumerate(evaluations)}
+    query_of_row = [retrievals[e["retrieval"]]["query"] for e in evaluations]
+    rank_of = {
+        item_id: rank
+        for r in retrievals.values()
+        for rank, item_id in enumerate(r.get("items", []))
+    }
+
+    rows, cols = [], []
+    pooled = defaultdict(set)
+    for query_id, literal in (query_literals or {}).items():
+        pooled[query_id].update((reference_bibcodes or {}).get(literal, ()))
+    for ioe in items_of_evaluation:
+        row = row_of.get(ioe["evaluation"])
+        rank = rank_of.get(ioe["retrieved_item"])
+        if row is None or rank is None or ioe.get("relevance") != "relevant":
+            continue
+        pooled[query_of_row[row]].add(retrieved_items.get(ioe["retrieved_item"]))
+        if rank < depth:
+            rows.append(row)
+            cols.append(rank)
+
+    rel = np.zeros((len(evaluations), depth), dtype=np.float64)
+    rel[np.asarray(rows, dtype=np.intp), np.asarray(cols, dtype=np.intp)] = 1.0
+    n_relevant = np.array(
+        [len(pooled[q] - {None}) for q in query_of_row], dtype=np.intp
+    )
+    return rel, n_relevant
+
+
+def compute_metrics(rel: np.ndarray, n_relevant: np.ndarray) -> Dict[str, np.ndarray]:
+    return {
+        "p_at_25": precision_at_k(rel, 25),
+        "r_at_1000": recall_at_k(rel, n_relevant, 1000),
+        "mrr": reciprocal_rank(rel),
+        "ndcg_at_25": ndcg_at_k(rel, n_relevant, 25),
+    }
+
+
+def _changed(doc: dict, values: Dict[str, float]) -> bool:
+    for field, value in values.items():
+        stored = doc.get(field)
+        if value is None or stored is None:
+            if value != stored:
+                return True
+        elif round(float(stored), 6) != value:
+            return True
+    return False
+
+
+def _completed_evaluations(client: WOQLClient) -> List[dict]:
+    """Read completed evaluations, with the query and query literal of their
+    retrieval, but without loading any retrievals, items or judgments."""
+    bindings = (
+        WQ()
+        .woql_and(
+            WQ().triple("v:eval", "type", "@schema:Evaluation"),
+            WQ().triple("v:eval", "done", True),
+            WQ().read_document("v:eval", "v:doc"),
+            WQ().triple("v:eval", "retrieval", "v:retrieval"),
+            WQ().triple("v:retrieval", "query", "v:query"),
+            WQ().triple("v:query", "query_literal", "v:query_literal"),
+        )
+        .execute(client)["bindings"]
+    )
+    return [
+        {
+            "doc": b["doc"],
+            "query": b["query"],
+            "query_literal": b["query_literal"]["@value"],
+        }
+        for b in bindings
+    ]
+
+
+def _judgments_digest(evaluations: List[dict], references: Iterable[str]) -> str:
+    """Digest what the metrics of a query's evaluations are computed from.
+
+    Judgments are written with their (completed) evaluation, so a query's
+    evaluations and when each was done stand in for its judgments.
+    """
+    return hash_of_json(
+        {
+            "evaluations": sorted([e["@id"], e.get("done_at")] for e in evaluations),
+            "references": sorted(references),
+            "depth": DEPTH,
+            "metrics": METRIC_FIELDS,
+        }
+    )
+
+
+def _items_of_evaluations_of_query(client: WOQLClient, query_id: str) -> List[dict]:
+    return [
+        b["doc"]
+        for b in WQ()
+        .woql_and(
+            WQ().triple("v:retrieval", "query", query_id),
+            WQ().triple("v:eval", "retrieval", "v:retrieval"),
+            WQ().triple("v:eval", "done", True),
+            WQ().triple("v:ioe", "evaluation", "v:eval"),
+            WQ().read_document("v:ioe", "v:doc"),
+        )
+        .execute(client)["bindings"]
+    ]
+
+
+def _bibcodes_of_items(client: WOQLClient, retrieval_id: str) -> Dict[str, str]:
+    return {
+        item_id: bibcode
+        for bibcode, item_id in retrieved_item_ids(client, retrieval_id).items()
+    }
+
+
+def update_evaluation_metrics(
+    client: WOQLClient,
+    reference_bibcodes: Dict[str, Iterable[str]] = None,
+    chunk_size: int = 100,
+    logger=None,
+) -> int:
+    """Compute metrics for the completed evaluations of queries whose judgments
+    changed since the last run, and write back only those whose values (or judgments
+    digest) are new or changed. Returns the number of evaluations updated.
+
+    Since relevant items are pooled per query, a new or changed evaluation changes
+    the recall and nDCG of every other evaluation of its query, so queries are
+    recomputed whole. Only the retrievals, items and judgments of those queries are
+    loaded.
+    """
+    by_query = defaultdict(list)
+    for e in _completed_evaluations(client):
+        by_query[(e["query"], e["query_literal"])].append(e["doc"])
+    stale = {}
+    for (query_id, literal), docs in by_query.items():
+        digest = _judgments_digest(docs, (reference_bibcodes or {}).get(literal, ()))
+        if any(d.get("metrics_digest") != digest for d in docs):
+            stale[query_id] = (literal, docs, digest)
+    if logger:
+        logger.info(f"{len(stale)}/{len(by_query)} queries have changed judgments")
+
+    changed = []
+    for query_id, (literal, evaluations, digest) in stale.items():
+        retrievals = {
+            r_id: client.get_document(r_id)
+            for r_id in {e["retrieval"] for e in evaluations}
+        }
+        retrieved_items = {}
+        for r_id in retrievals:
+            retrieved_items.update(_bibcodes_of_items(client, r_id))
+        rel, n_relevant = judgment_matrix(
+            evaluations,
+            retrievals,
+            retrieved_items,
+            _items_of_evaluations_of_query(client, query_id),
+            reference_bibcodes=reference_bibcodes,
+            query_literals={query_id: literal},
+        )
+        metrics = compute_metrics(rel, n_relevant)
+        for row, doc in enumerate(evaluations):
+            values = {
+                field: (
+                    None
+                    if np.isnan(metrics[field][row])
+                    else round(float(metrics[field][row]), 6)
+                )
+                for field in METRIC_FIELDS
+            }
+            if _changed(doc, values) or doc.get("metrics_digest") != digest:
+                updated = {k: v for k, v in doc.items() if k not in METRIC_FIELDS}
+                updated.update({k: v for k, v in values.items() if v is not None})
+                updated["metrics_digest"] = digest
+                changed.append(updated)
+
+    for i in range(0, len(changed), chunk_size):
+        client.update_document(
+            changed[i : i + chunk_size], commit_msg="updating evaluation metrics"
+        )
+        if logger:
+            logger.info(
+                f"updated metrics for {min(i + chunk_size, len(changed))}/{len(changed)} evaluations"
+            )
+    return len(changed)
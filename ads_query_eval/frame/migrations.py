@@ -0,0 +1,89 @@
+"""Data migrations, each safe to run again (e.g. after being interrupted)."""
+import logging
+
+from terminusdb_client import WOQLClient, WOQLQuery as WQ
+
+from ads_query_eval.config import get_terminus_client
+from ads_query_eval.lib.io import retrievable_item_ids
+
+
+def _unlinked_items_query(retrieval="v:retrieval"):
+    return WQ().woql_and(
+        WQ().triple("v:item", "type", "@schema:RetrievedItem"),
+        WQ().triple("v:item", "retrieval", retrieval),
+        WQ().woql_or(
+            WQ().woql_not(WQ().triple("v:item", "retrievable_item", "v:_")),
+            WQ().woql_not(WQ().triple("v:item", "rank", "v:_")),
+        ),
+    )
+
+
+def migrate_retrievable_items(
+    client: WOQLClient, chunk_size: int = 500, logger=None
+) -> int:
+    """Link RetrievedItems written before RetrievableItems existed to the (shared)
+    RetrievableItem of their bibcode, and record their rank in their retrieval.
+
+    RetrievedItems keep their ids (and so their ItemOfEvaluations), since the schema
+    still keys them on their bibcode and retrieval. Only once this has run on a
+    database can RetrievedItem be keyed on its retrieval and rank and lose its
+    `ads_bibcode`: TerminusDB checks existing documents against a new schema, and
+    rejects it while any RetrievedItem lacks `retrievable_item` or `rank`.
+
+    Returns the number of RetrievedItems migrated.
+    """
+    logger = logger or logging.getLogger(__name__)
+    retrieval_ids = [
+        b["retrieval"]
+        for b in WQ()
+        .distinct("v:retrieval", _unlinked_items_query())
+        .execute(client)["bindings"]
+    ]
+    n_migrated = 0
+    for n, retrieval_id in enumerate(retrieval_ids, start=1):
+        rank_of = {}
+        for rank, item_id in enumerate(client.get_document(retrieval_id)["items"]):
+            rank_of.setdefault(item_id, rank)
+        unlinked = {
+            # An item lacking both fields matches both branches of the `or`.
+            b["item"]: b["doc"]
+            for b in WQ()
+            .woql_and(
+                _unlinked_items_query(retrieval_id),
+                WQ().read_document("v:item", "v:doc"),
+            )
+            .execute(client)["bindings"]
+        }.values()
+        retrievable_ids = retrievable_item_ids(
+            client, [d["ads_bibcode"] for d in unlinked]
+        )
+        docs = []
+        for d in unlinked:
+            rank = d.get("rank", rank_of.get(d["@id"]))
+            docs.append(
+                {
+                    **d,
+                    "retrievable_item": retrievable_ids[d["ads_bibcode"]],
+                    **({"rank": rank} if rank is not None else {}),
+                }
+            )
+        for i in range(0, len(docs), chunk_size):
+            client.replace_document(
+                docs[i : i + chunk_size],
+                commit_msg="linking retrieved items to retrievable items",
+            )
+        n_migrated += len(docs)
+        unranked = sum(1 for d in docs if "rank" not in d)
+        if unranked:
+            # Not in the retrieval's `items`, e.g. left by an interrupted write.
+            logger.warning(f"{unranked} items of {retrieval_id} have no rank")
+        logger.info(
+            f"migrated {len(docs)} items of {retrieval_id} "
+            f"({n}/{len(retrieval_ids)} retrievals)"
+        )
+    return n_migrated
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    migrate_retrievable_items(get_terminus_client())
@@ -16,19 +16,34 @@ class Operation(BaseModel):
     status: str
 
 
+class RetrievableItem(BaseModel):
+    id: str = Field(..., alias="@id")
+    ads_bibcode: str
+
+
 class RetrievedItem(BaseModel):
     id: str = Field(..., alias="@id")
     retrieval: str
     ads_bibcode: str
+    retrievable_item: Optional[str]
+    rank: Optional[int]
 
 
 class Retrieval(Operation):
     query: str
     s3_key: str
-    items: List[str]
+    items: Optional[List[str]]  # not set when read without its items
+    content_digest: Optional[str]
+    n_items: Optional[int]
+
+
+class RetrievalSummary(Operation):
+    query: str
+    n_items: Optional[int]
 
 
 class RetrievedItemContent(BaseModel):
+    retrieved_item: Optional[str]
     citations: Dict[str, int] = Field(..., alias="[citations]")
     num_citations: Optional[int]
     num_references: Optional[int]
@@ -64,6 +79,8 @@ class Evaluation(Operation):
     evaluator: str
     p_at_25: Optional[float]
     r_at_1000: Optional[float]
+    mrr: Optional[float]
+    ndcg_at_25: Optional[float]
 
 
 class User(BaseModel):
@@ -0,0 +1,80 @@
+"""Compare the rankings of consecutive retrievals of a query.
+
+Rankings are arrays of bibcodes in rank order (e.g. the `bibcode` column of a
+retrieval-history partition, see `ads_query_eval.frame.history`).
+"""
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+TOP_KS = (25, 1000)
+RBO_P = 0.9
+
+
+def paired_ranks(previous: np.ndarray, current: np.ndarray):
+    """Return the items in both rankings, with their previous and current ranks."""
+    return np.intersect1d(previous, current, assume_unique=True, return_indices=True)
+
+
+def kendall_tau(x: np.ndarray, y: np.ndarray) -> Optional[float]:
+    """Kendall rank correlation of two rankings of the same items, without ties."""
+    n = len(x)
+    if n < 2:
+        return None
+    concordance = np.sign(x[:, None] - x[None, :]) * np.sign(y[:, None] - y[None, :])
+    return float(concordance.sum() / (n * (n - 1)))
+
+
+def rank_biased_overlap(
+    previous: np.ndarray, current: np.ndarray, p: float = RBO_P
+) -> Optional[float]:
+    """Extrapolated rank-biased overlap (Webber et al. 2010) to the shallower depth."""
+    k = min(len(previous), len(current))
+    if k == 0:
+        return None
+    _, i_previous, i_current = paired_ranks(previous[:k], current[:k])
+    # An item in both lists counts towards the overlap from the depth at which it
+    # has appeared in both.
+    depth_seen = np.maximum(i_previous, i_current) + 1
+    overlap = np.cumsum(np.bincount(depth_seen, minlength=k + 1)[1:])
+    depths = np.arange(1, k + 1)
+    agreement = overlap / depths
+    return float(agreement[-1] * p**k + (1 - p) / p * np.sum(agreement * p**depths))
+
+
+def rank_diff(
+    previous: Sequence[str], current: Sequence[str], top_ks=TOP_KS, p: float = RBO_P
+) -> Dict:
+    """Summarize how `current` ranks items differently from `previous`.
+
+    Only the first occurrence of an item repeated in a ranking (e.g. across pages of
+    results) is considered. Ranks in the result are zero-based.
+    """
+    previous = np.array(list(dict.fromkeys(previous)), dtype=object)
+    current = np.array(list(dict.fromkeys(current)), dtype=object)
+    common, i_previous, i_current = paired_ranks(previous, current)
+    moved = i_previous != i_current
+    order = np.argsort(i_current[moved], kind="stable")
+    return {
+        "n_previous": len(previous),
+        "n_current": len(current),
+        "n_common": len(common),
+        "kendall_tau": kendall_tau(i_previous, i_current),
+        "rank_biased_overlap": rank_biased_overlap(previous, current, p=p),
+        "rbo_p": p,
+        "mean_abs_rank_change": (
+            float(np.abs(i_previous - i_current).mean()) if len(common) else None
+        ),
+        **{
+            f"top{k}": {
+                "entered": current[:k][~np.isin(current[:k], previous[:k])].tolist(),
+                "exited": previous[:k][~np.isin(previous[:k], current[:k])].tolist(),
+            }
+            for k in top_ks
+        },
+        "moves": {
+            "bibcode": common[moved][order].tolist(),
+            "previous_rank": i_previous[moved][order].tolist(),
+            "rank": i_current[moved][order].tolist(),
+        },
+    }
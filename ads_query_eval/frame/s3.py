@@ -1,14 +1,40 @@
+import gzip
+import io
 import json
 from io import BytesIO
-from typing import Dict, Any
+from typing import Dict, Any, BinaryIO, Iterator, Tuple
 
+from boto3.s3.transfer import TransferConfig
 from mypy_boto3_s3.client import S3Client, Exceptions
 
 from ads_query_eval.config import get_s3_config
+from ads_query_eval.lib.timing import timed
+
+try:
+    import zstandard
+except ImportError:  # optional: only needed for S3_JSON_CODEC=zstd
+    zstandard = None
+
+try:
+    import ijson
+except ImportError:  # optional: only needed to parse JSON arrays incrementally
+    ijson = None
 
 s3_config = get_s3_config()
 
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+CODECS = ("gzip", "zstd", "identity")
+
+# Multipart, multi-threaded transfers for large objects, e.g. Dagster step outputs.
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=s3_config["s3_transfer_max_concurrency"],
+)
 
+
+@timed("s3")
 def put(
     client: S3Client,
     key: str,
@@ -26,34 +52,177 @@ def put(
     )
 
 
+def compress(body: bytes, codec: str) -> bytes:
+    if codec == "gzip":
+        return gzip.compress(body, compresslevel=6)
+    elif codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("codec 'zstd' requires the `zstandard` package")
+        return zstandard.ZstdCompressor(level=10).compress(body)
+    elif codec == "identity":
+        return body
+    raise ValueError(f"codec {codec} not supported. Use one of {CODECS}")
+
+
+def compressing_writer(f: BinaryIO, codec: str) -> BinaryIO:
+    """Wrap binary file `f` so that bytes written are compressed with `codec`.
+    Closing the returned writer finishes the stream but leaves `f` open."""
+    if codec == "gzip":
+        return gzip.GzipFile(fileobj=f, mode="wb", compresslevel=6)
+    elif codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("codec 'zstd' requires the `zstandard` package")
+        return zstandard.ZstdCompressor(level=10).stream_writer(f, closefd=False)
+    elif codec == "identity":
+        return _Unclosed(f)
+    raise ValueError(f"codec {codec} not supported. Use one of {CODECS}")
+
+
+class _Unclosed(io.RawIOBase):
+    def __init__(self, f: BinaryIO):
+        self._f = f
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        return self._f.write(b)
+
+
+@timed("s3")
 def put_json(
     client: S3Client,
     key: str,
     body: Any,
     acl: str = "public-read",
     metadata: Dict[str, str] = None,
+    codec: str = None,
 ):
+    codec = codec or s3_config["s3_json_codec"]
     try:
         body = json.dumps(body).encode("utf-8")
     except TypeError:
         raise TypeError(f"put_json: body given for key {key} is not JSON serializable")
     metadata = metadata or {}
+    extra_args = {"ContentEncoding": codec} if codec != "identity" else {}
+    body = compress(body, codec)
     client.put_object(
         Bucket=s3_config["s3_bucket"],
         Key=(s3_config["s3_prefix"] + key),
         Body=body,
         ContentType="application/json",
-        ContentEncoding="gzip",
         ACL=acl,
         Metadata=metadata,
+        **extra_args,
+    )
+    return len(body)
+
+
+@timed("s3")
+def upload_file(client: S3Client, key: str, path: str, acl: str = "private"):
+    client.upload_file(
+        path,
+        s3_config["s3_bucket"],
+        s3_config["s3_prefix"] + key,
+        ExtraArgs={"ACL": acl},
+        Config=TRANSFER_CONFIG,
+    )
+
+
+@timed("s3")
+def download_file(client: S3Client, key: str, path: str):
+    client.download_file(
+        s3_config["s3_bucket"],
+        s3_config["s3_prefix"] + key,
+        path,
+        Config=TRANSFER_CONFIG,
     )
 
 
+@timed("s3")
+def size_of(client: S3Client, key: str) -> int:
+    return client.head_object(
+        Bucket=s3_config["s3_bucket"], Key=s3_config["s3_prefix"] + key
+    )["ContentLength"]
+
+
+def list_keys(client: S3Client, prefix: str) -> Iterator[Tuple[str, int]]:
+    """Yield the key (not including the configured prefix) and size of each object
+    whose key starts with `prefix`."""
+    paginator = client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(
+        Bucket=s3_config["s3_bucket"], Prefix=s3_config["s3_prefix"] + prefix
+    ):
+        for obj in page.get("Contents", []):
+            yield obj["Key"][len(s3_config["s3_prefix"]) :], obj["Size"]
+
+
+@timed("s3")
 def get(client: S3Client, key: str) -> BytesIO:
     f = BytesIO()
     client.download_fileobj(s3_config["s3_bucket"], s3_config["s3_prefix"] + key, f)
     return f
 
 
+class _PrefixedStream(io.RawIOBase):
+    """Raw stream that replays already-consumed `prefix` bytes before reading from `raw`."""
+
+    def __init__(self, prefix: bytes, raw):
+        self._prefix = prefix
+        self._raw = raw
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self._prefix:
+            n = min(len(b), len(self._prefix))
+            b[:n], self._prefix = self._prefix[:n], self._prefix[n:]
+            return n
+        chunk = self._raw.read(len(b))
+        b[: len(chunk)] = chunk
+        return len(chunk)
+
+
+def decoded(raw) -> BinaryIO:
+    # Sniff the codec from magic bytes rather than trusting ContentEncoding:
+    # objects written before compression was applied claim "gzip" but are plain JSON.
+    head = raw.read(len(ZSTD_MAGIC))
+    stream = io.BufferedReader(_PrefixedStream(head, raw))
+    if head.startswith(GZIP_MAGIC):
+        return gzip.GzipFile(fileobj=stream, mode="rb")
+    elif head.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            raise RuntimeError("object is zstd-compressed; install `zstandard`")
+        return zstandard.ZstdDecompressor().stream_reader(stream)
+    return stream
+
+
+@timed("s3")
+def open_stream(client: S3Client, key: str) -> BinaryIO:
+    rv = client.get_object(
+        Bucket=s3_config["s3_bucket"], Key=s3_config["s3_prefix"] + key
+    )
+    return decoded(rv["Body"])
+
+
+@timed("s3")
 def get_json(client: S3Client, key: str):
-    return json.loads(get(client, key).getvalue())
+    """Parse the JSON object at `key`. The compressed body is streamed rather than
+    downloaded first, but the whole parsed object is held in memory: for a large
+    array, `iter_json` holds only one element at a time."""
+    with open_stream(client, key) as f:
+        return json.load(f)
+
+
+def iter_json(client: S3Client, key: str) -> Iterator[Any]:
+    """Yield the elements of the JSON array at `key` as they are parsed from the
+    decompressing stream.
+
+    Requires `ijson`; without it, parses the whole array before yielding.
+    """
+    with open_stream(client, key) as f:
+        if ijson is None:
+            yield from json.load(f)
+        else:
+            yield from ijson.items(f, "item", use_float=True)
@@ -6,5 +6,37 @@ from ads_query_eval.lib.util import (
     get_password_hash,
     pick,
     hash_of,
+    hash_of_json,
+    hash_of_json_array,
+    keyed_digest,
+    sign,
+    unsign,
+    memory_size_of,
+    LRUCache,
 )
-from ads_query_eval.lib.io import params_for, find_one, fetch_first_page, fetch_first_n
+from ads_query_eval.lib.io import (
+    params_for,
+    find_one,
+    short_id,
+    descending,
+    DocumentLoader,
+    find_retrieval,
+    retrieved_item_ids,
+    retrievable_item_ids,
+    write_retrieved_items,
+    retrievals_of_bibcode,
+    count_retrievals,
+    retrieval_summaries,
+    ads_get,
+    fetch_first_page,
+    fetch_page,
+    fetch_first_n,
+    digest_of_responses,
+)
+from ads_query_eval.lib.ratelimit import (
+    ADSAPIError,
+    ADSRateLimitExhausted,
+    RateLimiter,
+    get_ads_rate_limiter,
+)
+from ads_query_eval.lib.cache import DiskCache, get_ads_cache
@@ -0,0 +1,79 @@
+import json
+import sqlite3
+import time
+import zlib
+from contextlib import closing
+from functools import lru_cache
+from typing import Any, Optional
+
+from ads_query_eval.config import get_ads_cache_config
+
+
+class DiskCache:
+    """Size-bounded, persistent key-value cache of JSON values in a SQLite file.
+
+    Values are stored zlib-compressed with a per-entry expiry time. When the total
+    stored size exceeds `max_bytes`, least-recently-read entries are evicted.
+    Safe to share across threads and processes.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " key TEXT PRIMARY KEY, value BLOB, size INTEGER,"
+                " expires_at REAL, accessed_at REAL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=60, isolation_level=None)
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at < now:
+                conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(zlib.decompress(value))
+
+    def set(self, key: str, value: Any, ttl: float):
+        blob = zlib.compress(json.dumps(value).encode("utf-8"))
+        if len(blob) > self.max_bytes:
+            return
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)",
+                (key, blob, len(blob), now + ttl, now),
+            )
+            conn.execute("DELETE FROM cache WHERE expires_at < ?", (now,))
+            (total,) = conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM cache"
+            ).fetchone()
+            for evict_key, size in conn.execute(
+                "SELECT key, size FROM cache ORDER BY accessed_at"
+            ).fetchall():
+                if total <= self.max_bytes:
+                    break
+                conn.execute("DELETE FROM cache WHERE key = ?", (evict_key,))
+                total -= size
+            conn.execute("COMMIT")
+
+
+@lru_cache
+def get_ads_cache() -> DiskCache:
+    config = get_ads_cache_config()
+    return DiskCache(path=config["path"], max_bytes=config["max_bytes"])
@@ -1,9 +1,31 @@
-from urllib.parse import urlencode
+import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlencode, unquote
 
 import requests
-from terminusdb_client import WOQLClient
+from tenacity import (
+    retry,
+    retry_if_exception,
+    stop_after_attempt,
+    wait_random_exponential,
+)
+from terminusdb_client import WOQLClient, WOQLQuery as WQ
+from terminusdb_client.errors import DatabaseError
 
-from ads_query_eval.config import QUERY_BASE_URL, HEADERS
+from ads_query_eval.config import (
+    QUERY_BASE_URL,
+    ADS_API_MAX_CONCURRENCY,
+    get_ads_cache_config,
+    get_ads_session,
+)
+from ads_query_eval.lib.cache import get_ads_cache
+from ads_query_eval.lib.ratelimit import (
+    ADSAPIError,
+    ADSRateLimitExhausted,
+    get_ads_rate_limiter,
+)
+from ads_query_eval.lib.util import hash_of_json_array
 
 
 def params_for(q=""):
@@ -33,36 +55,523 @@ def find_one(client: WOQLClient, document_template: dict):
     return rv[0] if len(rv) > 0 else None
 
 
-def fetch_first_page(q):
-    encoded_query = urlencode(params_for(q))
-    response = requests.get(f"{QUERY_BASE_URL}?{encoded_query}", headers=HEADERS)
+def short_id(id_: str) -> str:
+    """Strip the instance prefix from a document id returned by `insert_document`."""
+    return "/".join(id_.split("/")[-2:])
+
+
+def descending(variable: str) -> dict:
+    """An ordering for `WQ().order_by`, which (as of terminusdb-client 10.2) ignores
+    its `order` argument and always sorts variables given by name ascending."""
+    return {
+        "@type": "OrderTemplate",
+        "variable": variable.removeprefix("v:"),
+        "order": "desc",
+    }
+
+
+class DocumentLoader:
+    """Request-scoped memo of Terminus documents that fetches what it lacks in one query.
+
+    Create one per request (e.g. as a FastAPI dependency) so that documents looked up
+    by several functions handling the request are fetched at most once.
+    """
+
+    def __init__(self, client: WOQLClient):
+        self.client = client
+        self._docs = {}
+        self._found = {}
+
+    def prime(self, *docs: dict):
+        for doc in docs:
+            self._docs[doc["@id"]] = doc
+
+    def get_many(self, ids: Iterable[str]) -> List[Optional[dict]]:
+        ids = list(ids)
+        missing = [i for i in dict.fromkeys(ids) if i not in self._docs]
+        if missing:
+            bindings = (
+                WQ()
+                .woql_or(*[WQ().read_document(i, "v:doc") for i in missing])
+                .execute(self.client)["bindings"]
+            )
+            self.prime(*(b["doc"] for b in bindings))
+        return [self._docs.get(i) for i in ids]
+
+    def get(self, id_: str) -> Optional[dict]:
+        return self.get_many([id_])[0]
+
+    def find_one(self, document_template: dict) -> Optional[dict]:
+        key = json.dumps(document_template, sort_keys=True)
+        if key not in self._found:
+            doc = find_one(self.client, document_template)
+            if doc:
+                self.prime(doc)
+            self._found[key] = doc["@id"] if doc else None
+        return self._docs.get(self._found[key])
+
+    def find_one_with_references(
+        self, type_: str, field: str, value, references: Iterable[str] = ()
+    ) -> Optional[dict]:
+        """Find a `type_` document by a `field` value, together with the documents
+        referenced by its `references` fields, in a single round-trip."""
+        key = json.dumps([type_, field, value], sort_keys=True)
+        if key in self._found:
+            doc = self._docs.get(self._found[key])
+            if doc:
+                self.get_many(doc[r] for r in references)
+            return doc
+        references = list(references)
+        bindings = (
+            WQ()
+            .limit(1)
+            .woql_and(
+                WQ().triple(
+                    "v:doc_id",
+                    field,
+                    WQ().string(value) if isinstance(value, str) else value,
+                ),
+                WQ().triple("v:doc_id", "type", f"@schema:{type_}"),
+                WQ().read_document("v:doc_id", "v:doc"),
+                *[
+                    WQ().woql_and(
+                        WQ().triple("v:doc_id", r, f"v:ref_{n}"),
+                        WQ().read_document(f"v:ref_{n}", f"v:ref_doc_{n}"),
+                    )
+                    for n, r in enumerate(references)
+                ],
+            )
+            .execute(self.client)["bindings"]
+        )
+        if not bindings:
+            self._found[key] = None
+            return None
+        [binding] = bindings
+        self.prime(
+            binding["doc"], *(binding[f"ref_doc_{n}"] for n in range(len(references)))
+        )
+        self._found[key] = binding["doc"]["@id"]
+        return binding["doc"]
+
+    def find_retrieval(self, field: str, value) -> Optional[dict]:
+        """Find a Retrieval by a field value, without reading its `items` list.
+
+        The retrieval's Query is fetched in the same round-trip. The (partial)
+        retrieval is not memoized, so a later `get` of it reads the full document.
+        """
+        bindings = (
+            WQ()
+            .limit(1)
+            .woql_and(
+                WQ().triple(
+                    "v:retrieval",
+                    field,
+                    WQ().string(value) if isinstance(value, str) else value,
+                ),
+                WQ().triple("v:retrieval", "type", "@schema:Retrieval"),
+                *[
+                    WQ().opt(WQ().triple("v:retrieval", f, f"v:{f}"))
+                    for f in RETRIEVAL_FIELDS
+                ],
+                WQ().read_document("v:query", "v:query_doc"),
+            )
+            .execute(self.client)["bindings"]
+        )
+        if not bindings:
+            return None
+        [binding] = bindings
+        self.prime(binding["query_doc"])
+        return retrieval_from_binding(binding)
+
+
+# Retrieval fields other than `items`.
+RETRIEVAL_FIELDS = (
+    "query",
+    "s3_key",
+    "status",
+    "done",
+    "done_at",
+    "content_digest",
+    "n_items",
+)
+
+
+def retrieval_from_binding(binding: dict) -> dict:
+    doc = {"@type": "Retrieval", "@id": binding["retrieval"]}
+    for field in RETRIEVAL_FIELDS:
+        value = _value(binding.get(field))
+        if value is not None:
+            doc[field] = value
+    doc["status"] = unquote(doc["status"].rpartition("/")[-1])
+    return doc
+
+
+def find_retrieval(client: WOQLClient, retrieval_id: str) -> Optional[dict]:
+    """Read a Retrieval document, except for its `items` list."""
+    bindings = (
+        WQ()
+        .limit(1)
+        .woql_and(
+            WQ().eq("v:retrieval", WQ().iri(retrieval_id)),
+            WQ().triple("v:retrieval", "type", "@schema:Retrieval"),
+            *[
+                WQ().opt(WQ().triple("v:retrieval", f, f"v:{f}"))
+                for f in RETRIEVAL_FIELDS
+            ],
+        )
+        .execute(client)["bindings"]
+    )
+    return retrieval_from_binding(bindings[0]) if bindings else None
+
+
+def retrieved_item_ids(client: WOQLClient, retrieval_id: str) -> Dict[str, str]:
+    """Map bibcode to RetrievedItem id for the items already written for a retrieval."""
+    bindings = (
+        WQ()
+        .woql_and(
+            WQ().triple("v:item", "retrieval", retrieval_id),
+            WQ().triple("v:item", "type", "@schema:RetrievedItem"),
+            WQ().triple("v:item", "retrievable_item", "v:retrievable"),
+            WQ().triple("v:retrievable", "ads_bibcode", "v:bibcode"),
+        )
+        .execute(client)["bindings"]
+    )
+    return {_value(b["bibcode"]): b["item"] for b in bindings}
+
+
+def _existing_retrievable_item_ids(
+    client: WOQLClient, bibcodes: List[str]
+) -> Dict[str, str]:
+    bindings = (
+        WQ()
+        .woql_or(
+            *[
+                WQ().woql_and(
+                    WQ().eq("v:bibcode", WQ().string(b)),
+                    WQ().triple("v:retrievable", "ads_bibcode", "v:bibcode"),
+                    WQ().triple("v:retrievable", "type", "@schema:RetrievableItem"),
+                )
+                for b in bibcodes
+            ]
+        )
+        .execute(client)["bindings"]
+    )
+    return {_value(b["bibcode"]): b["retrievable"] for b in bindings}
+
+
+def retrievable_item_ids(
+    client: WOQLClient, bibcodes: List[str], chunk_size: int = 100, attempts: int = 3
+) -> Dict[str, str]:
+    """Map bibcode to RetrievableItem id, inserting the RetrievableItems of bibcodes
+    not yet retrieved.
+
+    Another writer may insert some of the same RetrievableItems concurrently; the
+    insert is then retried, after looking up what exists again, up to `attempts`
+    times.
+    """
+    ids = {}
+    bibcodes = list(dict.fromkeys(bibcodes))
+    for i in range(0, len(bibcodes), chunk_size):
+        chunk = bibcodes[i : i + chunk_size]
+        for attempt in range(1, attempts + 1):
+            ids.update(_existing_retrievable_item_ids(client, chunk))
+            missing = [b for b in chunk if b not in ids]
+            if not missing:
+                break
+            try:
+                client.insert_document(
+                    [{"@type": "RetrievableItem", "ads_bibcode": b} for b in missing],
+                    commit_msg=f"adding {len(missing)} retrievable items",
+                )
+            except DatabaseError as e:
+                if e.status_code >= 500 or attempt == attempts:
+                    raise
+            else:
+                ids.update(_existing_retrievable_item_ids(client, missing))
+                break
+    return ids
+
+
+def _is_transient_terminus_error(exception: BaseException) -> bool:
+    if isinstance(exception, DatabaseError):
+        return exception.status_code >= 500
+    return isinstance(exception, (requests.ConnectionError, requests.Timeout))
+
+
+@retry(
+    retry=retry_if_exception(_is_transient_terminus_error),
+    wait=wait_random_exponential(multiplier=1, max=30),
+    stop=stop_after_attempt(5),
+    reraise=True,
+)
+def _write_retrieved_items(
+    client: WOQLClient, retrieval_id: str, ranked_items: List[Tuple[int, str, str]]
+):
+    # RetrievedItems have deterministic ids, so replacing (with create) is
+    # idempotent: a retry after a timed-out, yet committed, write rewrites the same
+    # documents.
+    client.replace_document(
+        [
+            {
+                "@type": "RetrievedItem",
+                "ads_bibcode": b,
+                "retrieval": retrieval_id,
+                "retrievable_item": retrievable_id,
+                "rank": rank,
+            }
+            for rank, b, retrievable_id in ranked_items
+        ],
+        create=True,
+        commit_msg=f"adding {len(ranked_items)} items to {retrieval_id}",
+    )
+
+
+def write_retrieved_items(
+    client: WOQLClient,
+    retrieval_id: str,
+    bibcodes: List[str],
+    chunk_size: int = 100,
+    logger=None,
+) -> List[str]:
+    """Write the RetrievedItems of a retrieval, and any RetrievableItems they are
+    instances of, in commits of `chunk_size` items.
+
+    Items already written (e.g. by an earlier, interrupted run) are skipped, so this
+    is safe to call again. Returns the RetrievedItem ids in the order of `bibcodes`.
+    """
+    ids = retrieved_item_ids(client, retrieval_id)
+    rank_of = {}
+    for rank, b in enumerate(bibcodes):
+        rank_of.setdefault(b, rank)
+    missing = [(rank, b) for b, rank in rank_of.items() if b not in ids]
+    if logger and ids:
+        logger.info(f"{len(ids)} items of {retrieval_id} already written")
+    if missing:
+        retrievable_ids = retrievable_item_ids(
+            client, [b for _, b in missing], chunk_size=chunk_size
+        )
+    for i in range(0, len(missing), chunk_size):
+        _write_retrieved_items(
+            client,
+            retrieval_id,
+            [(rank, b, retrievable_ids[b]) for rank, b in missing[i : i + chunk_size]],
+        )
+        if logger:
+            logger.info(
+                f"wrote {min(i + chunk_size, len(missing))}/{len(missing)} items"
+            )
+    if missing:
+        ids = retrieved_item_ids(client, retrieval_id)
+    return [ids[b] for b in bibcodes]
+
+
+def retrievals_of_bibcode(client: WOQLClient, bibcode: str) -> List[dict]:
+    """Return the retrievals that yielded a bibcode, with its rank in each, most
+    recent first."""
+    bindings = (
+        WQ()
+        .order_by(descending("v:done_at"))
+        .woql_and(
+            WQ().triple("v:retrievable", "ads_bibcode", WQ().string(bibcode)),
+            WQ().triple("v:retrievable", "type", "@schema:RetrievableItem"),
+            WQ().triple("v:item", "retrievable_item", "v:retrievable"),
+            WQ().triple("v:item", "retrieval", "v:retrieval"),
+            WQ().triple("v:retrieval", "query", "v:query"),
+            WQ().triple("v:retrieval", "done_at", "v:done_at"),
+            WQ().opt(WQ().triple("v:item", "rank", "v:rank")),
+        )
+        .execute(client)["bindings"]
+    )
+    return [
+        {
+            "retrieval": b["retrieval"],
+            "query": b["query"],
+            "done_at": _value(b["done_at"]),
+            "retrieved_item": b["item"],
+            "rank": _value(b.get("rank")),
+        }
+        for b in bindings
+    ]
+
+
+def _value(binding_value):
+    return (
+        binding_value.get("@value")
+        if isinstance(binding_value, dict)
+        else binding_value
+    )
+
+
+def count_retrievals(client: WOQLClient, query_id: str) -> int:
+    [binding] = (
+        WQ()
+        .count(
+            "v:n",
+            WQ().woql_and(
+                WQ().triple("v:retrieval", "query", query_id),
+                WQ().triple("v:retrieval", "type", "@schema:Retrieval"),
+                WQ().triple("v:retrieval", "done_at", "v:done_at"),
+            ),
+        )
+        .execute(client)["bindings"]
+    )
+    return int(_value(binding["n"]))
+
+
+def retrieval_summaries(
+    client: WOQLClient, query_id: str, before: str = None, limit: int = 50
+) -> List[dict]:
+    """Return id, status, done_at and item count of done retrievals of a query,
+    most recent first, without reading the retrievals' `items` lists.
+
+    Pass the `done_at` of the last summary of a page as `before` to get the next page.
+    """
+    bindings = (
+        WQ()
+        .limit(limit)
+        .order_by(descending("v:done_at"))
+        .woql_and(
+            WQ().triple("v:retrieval", "query", query_id),
+            WQ().triple("v:retrieval", "type", "@schema:Retrieval"),
+            WQ().triple("v:retrieval", "done_at", "v:done_at"),
+            WQ().triple("v:retrieval", "status", "v:status"),
+            *(
+                [WQ().less("v:done_at", WQ().literal(before, "xsd:dateTime"))]
+                if before
+                else []
+            ),
+            WQ().opt(WQ().triple("v:retrieval", "n_items", "v:n_items")),
+        )
+        .execute(client)["bindings"]
+    )
+    summaries = [
+        {
+            "@id": b["retrieval"],
+            "query": query_id,
+            "done": True,
+            "done_at": _value(b["done_at"]),
+            "status": unquote(_value(b["status"]).rpartition("/")[-1]),
+            "n_items": _value(b.get("n_items")),
+        }
+        for b in bindings
+    ]
+
+    # Retrievals formatted before `n_items` was recorded: count their RetrievedItems.
+    uncounted = [s["@id"] for s in summaries if s["n_items"] is None]
+    if uncounted:
+        n_items = {
+            b["retrieval"]: int(_value(b["n"]))
+            for b in WQ()
+            .woql_or(
+                *[
+                    WQ().woql_and(
+                        WQ().eq("v:retrieval", WQ().iri(id_)),
+                        WQ().count("v:n", WQ().triple("v:item", "retrieval", id_)),
+                    )
+                    for id_ in uncounted
+                ]
+            )
+            .execute(client)["bindings"]
+        }
+        for s in summaries:
+            if s["n_items"] is None:
+                s["n_items"] = n_items.get(s["@id"], 0)
+    return summaries
+
+
+def _is_transient(exception: BaseException) -> bool:
+    if isinstance(exception, ADSRateLimitExhausted):
+        return False
+    if isinstance(exception, ADSAPIError):
+        return exception.status_code == 429 or exception.status_code >= 500
+    return isinstance(exception, (requests.ConnectionError, requests.Timeout))
+
+
+@retry(
+    retry=retry_if_exception(_is_transient),
+    wait=wait_random_exponential(multiplier=1, max=60),
+    stop=stop_after_attempt(6),
+    reraise=True,
+)
+def _ads_get_uncached(params: dict) -> dict:
+    rate_limiter = get_ads_rate_limiter()
+    rate_limiter.acquire()
+    response = get_ads_session().get(f"{QUERY_BASE_URL}?{urlencode(params)}")
+    rate_limiter.update_from_headers(response.headers)
     if response.status_code != 200:
-        raise Exception(response.text)
+        raise ADSAPIError(response.status_code, response.text)
     return response.json()
 
 
-def fetch_first_n(q, n=1000, logger=None):
-    responses = []
-    n_fetched_total = 0
-    start = 0
+def _cache_ttl_for(params: dict) -> float:
+    config = get_ads_cache_config()
+    if params.get("q", "").startswith("bibcode:"):
+        return config["ttl_bibcode"]
+    return config["ttl_search"]
+
+
+def ads_get(params: dict, use_cache=True) -> dict:
+    ttl = _cache_ttl_for(params) if use_cache else 0
+    if not ttl:
+        return _ads_get_uncached(params)
+    cache, key = get_ads_cache(), urlencode(sorted(params.items()))
+    rv = cache.get(key)
+    if rv is None:
+        rv = _ads_get_uncached(params)
+        cache.set(key, rv, ttl=ttl)
+    return rv
+
+
+def fetch_first_page(q):
+    return fetch_page(q)
+
+
+def fetch_page(q, start=0, rows=25):
+    params = params_for(q)
+    params["rows"] = str(rows)
+    params["start"] = str(start)
+    return ads_get(params)
+
+
+def fetch_first_n(q, n=1000, logger=None, max_workers=None):
+    """Fetch the first `n` results for query `q` as a list of ADS responses, one per page.
+
+    The first page reveals `numFound`, after which the remaining pages are fetched
+    concurrently (up to `max_workers` at a time, default `ADS_API_MAX_CONCURRENCY`).
+    Pages are returned in `start` order regardless of completion order.
+    """
+    max_workers = max_workers or ADS_API_MAX_CONCURRENCY
     rows = 200 if n > 200 else n
-    while True:
-        params = params_for(q)
-        params["rows"] = str(rows)
-        params["start"] = str(start)
-        response = requests.get(
-            f"{QUERY_BASE_URL}?{urlencode(params)}", headers=HEADERS
-        )
-        if response.status_code != 200:
-            raise Exception(response.text)
-        rv = response.json()
-        responses.append(rv)
-        n_fetched = len(rv["response"]["docs"])
-        n_fetched_total += n_fetched
-        if n_fetched_total >= n or n_fetched < rows:
-            break
-        else:
-            start += rows
-            if logger:
-                logger.info(f"q: {q} start: {start}...")
+    first = fetch_page(q, start=0, rows=rows)
+    responses = [first]
+    if len(first["response"]["docs"]) < rows:
+        return responses
+
+    starts = list(range(rows, min(n, first["response"]["numFound"]), rows))
+    if not starts:
+        return responses
+    if logger:
+        logger.info(f"q: {q} fetching {len(starts)} more pages of {rows} rows...")
+    if max_workers <= 1:
+        responses.extend(fetch_page(q, start=start, rows=rows) for start in starts)
+    else:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(starts))) as executor:
+            responses.extend(
+                executor.map(
+                    lambda start: fetch_page(q, start=start, rows=rows), starts
+                )
+            )
+    if logger:
+        logger.info(f"ADS API quota: {get_ads_rate_limiter().quota()}")
     return responses
+
+
+def digest_of_responses(responses) -> str:
+    # Digest only the retrieved content (docs and highlighting) of each page:
+    # `responseHeader` carries per-request values like `QTime` that differ between
+    # otherwise-identical retrievals. `responses` may be an iterator, e.g. over pages
+    # as they are parsed.
+    return hash_of_json_array(
+        {"docs": r["response"]["docs"], "highlighting": r.get("highlighting")}
+        for r in responses
+    )
@@ -0,0 +1,109 @@
+"""Bounded pool of clients that are not safe to share between threads."""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Generic, List, Tuple, Type, TypeVar
+
+from ads_query_eval.lib.timing import span
+
+T = TypeVar("T")
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ClientPool(Generic[T]):
+    """Check clients out for exclusive use, and back in for reuse.
+
+    At most `maxsize` clients exist at once; `checkout` waits up to `timeout` seconds
+    for one to be checked in. Clients are made by `connect` when needed. A client
+    that has been idle for more than `check_after` seconds is passed to `check`
+    before reuse, and replaced if that raises. Checkouts, including any waiting,
+    checking and connecting, are timed as spans of `name`.
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], T],
+        maxsize: int,
+        name: str = "pool",
+        timeout: float = None,
+        check: Callable[[T], object] = None,
+        check_after: float = 30.0,
+        broken_by: Tuple[Type[BaseException], ...] = (),
+    ):
+        self.connect = connect
+        self.maxsize = maxsize
+        self.name = name
+        self.timeout = timeout
+        self.check = check
+        self.check_after = check_after
+        self.broken_by = broken_by
+        self._idle: List[Tuple[T, float]] = []  # (client, checked in at); LIFO
+        self._slots = threading.BoundedSemaphore(maxsize)
+        self._lock = threading.Lock()
+
+    def checkout(self) -> T:
+        with span(self.name, "checkout"):
+            return self._checkout()
+
+    def _checkout(self) -> T:
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolTimeout(f"no client checked in within {self.timeout}s")
+        try:
+            while True:
+                with self._lock:
+                    if not self._idle:
+                        break
+                    client, checked_in_at = self._idle.pop()
+                if self.check is None or time.monotonic() - checked_in_at < (
+                    self.check_after
+                ):
+                    return client
+                try:
+                    self.check(client)
+                    return client
+                except Exception:
+                    continue  # drop it, and try the next idle client
+            return self.connect()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def checkin(self, client: T):
+        with self._lock:
+            self._idle.append((client, time.monotonic()))
+        self._slots.release()
+
+    def discard(self, client: T):
+        """Give up the slot of a checked-out client without reusing the client."""
+        self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        client = self.checkout()
+        try:
+            yield client
+        except self.broken_by:
+            self.discard(client)
+            raise
+        except BaseException:
+            self.checkin(client)
+            raise
+        else:
+            self.checkin(client)
+
+    def clear(self):
+        with self._lock:
+            self._idle.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            idle = len(self._idle)
+        return {
+            "maxsize": self.maxsize,
+            "idle": idle,
+            # BoundedSemaphore keeps its count in `_value`; there is no public accessor.
+            "checked_out": self.maxsize - self._slots._value,
+        }
@@ -0,0 +1,116 @@
+import sqlite3
+import time
+from contextlib import closing
+from functools import lru_cache
+from typing import Mapping, Optional
+
+from ads_query_eval.config import get_ads_rate_limit_config
+
+
+class ADSAPIError(Exception):
+    def __init__(self, status_code: int, text: str):
+        super().__init__(text)
+        self.status_code = status_code
+
+
+class ADSRateLimitExhausted(ADSAPIError):
+    def __init__(self, reset_at: float):
+        super().__init__(
+            429,
+            f"ADS API quota exhausted until {time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(reset_at))}",
+        )
+        self.reset_at = reset_at
+
+
+class RateLimiter:
+    """Token bucket shared by all threads and processes that use the same SQLite file.
+
+    Tokens refill at `rate` per second up to `burst`. Independently, the daily quota that
+    ADS reports via `X-RateLimit-*` response headers is tracked: it is decremented per
+    request and corrected from headers as responses arrive, and once it reaches zero
+    `acquire` raises `ADSRateLimitExhausted` until the reported reset time.
+    """
+
+    def __init__(self, path: str, rate: float, burst: int, name: str = "ads"):
+        self.path = path
+        self.rate = rate
+        self.burst = burst
+        self.name = name
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS bucket ("
+                " name TEXT PRIMARY KEY, tokens REAL, updated_at REAL,"
+                " quota_limit INTEGER, quota_remaining INTEGER, quota_reset_at REAL)"
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO bucket VALUES (?, ?, ?, NULL, NULL, NULL)",
+                (name, float(burst), time.time()),
+            )
+
+    def _connect(self):
+        # Autocommit mode, so `BEGIN IMMEDIATE` below is what takes the cross-process lock.
+        return sqlite3.connect(self.path, timeout=60, isolation_level=None)
+
+    def acquire(self):
+        while True:
+            with closing(self._connect()) as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                tokens, updated_at, remaining, reset_at = conn.execute(
+                    "SELECT tokens, updated_at, quota_remaining, quota_reset_at"
+                    " FROM bucket WHERE name = ?",
+                    (self.name,),
+                ).fetchone()
+                now = time.time()
+                if reset_at is not None and now >= reset_at:
+                    remaining, reset_at = None, None
+                if remaining is not None and remaining <= 0:
+                    conn.execute("COMMIT")
+                    raise ADSRateLimitExhausted(reset_at)
+                tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+                if tokens >= 1:
+                    conn.execute(
+                        "UPDATE bucket SET tokens = ?, updated_at = ?,"
+                        " quota_remaining = ?, quota_reset_at = ? WHERE name = ?",
+                        (
+                            tokens - 1,
+                            now,
+                            None if remaining is None else remaining - 1,
+                            reset_at,
+                            self.name,
+                        ),
+                    )
+                    conn.execute("COMMIT")
+                    return
+                conn.execute("COMMIT")
+            time.sleep((1 - tokens) / self.rate)
+
+    def update_from_headers(self, headers: Mapping[str, str]):
+        try:
+            limit = int(headers["X-RateLimit-Limit"])
+            remaining = int(headers["X-RateLimit-Remaining"])
+            reset_at = float(headers["X-RateLimit-Reset"])
+        except (KeyError, ValueError):
+            return
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE bucket SET quota_limit = ?, quota_remaining = ?,"
+                " quota_reset_at = ? WHERE name = ?",
+                (limit, remaining, reset_at, self.name),
+            )
+
+    def quota(self) -> Optional[dict]:
+        with closing(self._connect()) as conn:
+            limit, remaining, reset_at = conn.execute(
+                "SELECT quota_limit, quota_remaining, quota_reset_at"
+                " FROM bucket WHERE name = ?",
+                (self.name,),
+            ).fetchone()
+        if limit is None:
+            return None
+        return {"limit": limit, "remaining": remaining, "reset_at": reset_at}
+
+
+@lru_cache
+def get_ads_rate_limiter() -> RateLimiter:
+    config = get_ads_rate_limit_config()
+    return RateLimiter(path=config["path"], rate=config["rate"], burst=config["burst"])
@@ -0,0 +1,213 @@
+"""Request and dependency timings, exported in the Prometheus text format.
+
+Spans time calls to a dependency (e.g. "terminus", "s3", "bcrypt", "template"),
+broken down by operation. They are recorded into process-wide histograms and,
+within a request (see `request_timings`), accumulated per dependency so that the
+app can report them in a `Server-Timing` header.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Dict, Iterable, Optional, Tuple
+
+# Seconds. Upper bounds of the histogram buckets, besides +Inf.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# dependency -> [total seconds, number of calls] for the current request, if any.
+_request_spans: ContextVar[Optional[Dict[str, list]]] = ContextVar(
+    "request_spans", default=None
+)
+# Dependencies with a span in progress, so that nested spans (e.g. `s3.get_json`
+# calling `s3.open_stream`) count once towards the request's time per dependency.
+_active: ContextVar[frozenset] = ContextVar("active_spans", default=frozenset())
+
+
+class Histogram:
+    """Thread-safe cumulative histogram, with one series per combination of labels."""
+
+    def __init__(self, name: str, help_: str, labelnames: Tuple[str, ...]):
+        self.name = name
+        self.help = help_
+        self.labelnames = labelnames
+        self._series = {}  # label values -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues: str):
+        i = bisect_left(BUCKETS, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * len(BUCKETS), 0.0, 0]
+            if i < len(BUCKETS):
+                series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def exposition(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            series = sorted(
+                (k, (list(v[0]), v[1], v[2])) for k, v in self._series.items()
+            )
+        for labelvalues, (buckets, sum_, count) in series:
+            labels = _labels(zip(self.labelnames, labelvalues))
+            cumulative = 0
+            for le, n in zip(BUCKETS, buckets):
+                cumulative += n
+                yield f"{self.name}_bucket{_labels_with(labels, le=le)} {cumulative}"
+            yield f'{self.name}_bucket{_labels_with(labels, le="+Inf")} {count}'
+            yield f"{self.name}_sum{_braced(labels)} {sum_}"
+            yield f"{self.name}_count{_braced(labels)} {count}"
+
+
+request_seconds = Histogram(
+    "ads_query_eval_request_seconds",
+    "Time to respond to an HTTP request, by route template.",
+    ("method", "route", "status"),
+)
+dependency_seconds = Histogram(
+    "ads_query_eval_dependency_seconds",
+    "Time spent calling a dependency, by operation.",
+    ("dependency", "operation"),
+)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _labels(pairs) -> str:
+    return ",".join(f'{k}="{_escape(v)}"' for k, v in pairs)
+
+
+def _braced(labels: str) -> str:
+    return "{" + labels + "}" if labels else ""
+
+
+def _labels_with(labels: str, le) -> str:
+    return _braced(",".join(filter(None, [labels, _labels([("le", le)])])))
+
+
+@contextmanager
+def span(dependency: str, operation: str):
+    active = _active.get()
+    reset_token = _active.set(active | {dependency})
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        _active.reset(reset_token)
+        dependency_seconds.observe(elapsed, dependency, operation)
+        spans = _request_spans.get()
+        if spans is not None and dependency not in active:
+            total = spans.setdefault(dependency, [0.0, 0])
+            total[0] += elapsed
+            total[1] += 1
+
+
+def timed(dependency: str):
+    """Decorate a function so that its calls are recorded as spans of `dependency`."""
+
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            with span(dependency, f.__name__):
+                return f(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class Instrumented:
+    """Proxy to `target` recording a span of `dependency` for each method call."""
+
+    def __init__(self, target, dependency: str):
+        self._target = target
+        self._dependency = dependency
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if not callable(attr):
+            return attr
+
+        @wraps(attr)
+        def wrapper(*args, **kwargs):
+            with span(self._dependency, name):
+                return attr(*args, **kwargs)
+
+        return wrapper
+
+
+@contextmanager
+def request_timings():
+    """Collect the spans of the current request (including those recorded in worker
+    threads the request's context is copied to) into the yielded dict."""
+    spans = {}
+    reset_token = _request_spans.set(spans)
+    try:
+        yield spans
+    finally:
+        _request_spans.reset(reset_token)
+
+
+def server_timing(spans: Dict[str, list], total: float) -> str:
+    """Format request spans (and the `total` request time, in seconds) as the value
+    of a `Server-Timing` header."""
+    entries = [
+        f'{name};dur={seconds * 1000:.1f};desc="{n} call{"s" if n != 1 else ""}"'
+        for name, (seconds, n) in sorted(spans.items())
+    ]
+    return ", ".join(entries + [f"total;dur={total * 1000:.1f}"])
+
+
+def cache_exposition(caches: Dict[str, object]) -> Iterable[str]:
+    """Export the `stats()` of named `LRUCache`s."""
+    stats = {name: cache.stats() for name, cache in caches.items()}
+    for stat, type_, help_ in (
+        ("hits", "counter", "Cache lookups that found an entry."),
+        ("misses", "counter", "Cache lookups that found no live entry."),
+        ("entries", "gauge", "Entries in the cache."),
+        ("weight", "gauge", "Total weight of the entries in the cache."),
+        ("maxsize", "gauge", "Maximum total weight of the entries in the cache."),
+    ):
+        name = f"ads_query_eval_cache_{stat}" + ("_total" if type_ == "counter" else "")
+        yield f"# HELP {name} {help_}"
+        yield f"# TYPE {name} {type_}"
+        for cache_name, s in stats.items():
+            yield f"{name}{_braced(_labels([('cache', cache_name)]))} {s[stat]}"
+
+
+def pool_exposition(pools: Dict[str, object]) -> Iterable[str]:
+    """Export the `stats()` of named `ClientPool`s."""
+    stats = {name: pool.stats() for name, pool in pools.items()}
+    for stat, help_ in (
+        ("checked_out", "Clients checked out of the pool."),
+        ("idle", "Clients checked in to the pool, for reuse."),
+        ("maxsize", "Maximum number of clients of the pool."),
+    ):
+        name = f"ads_query_eval_pool_{stat}"
+        yield f"# HELP {name} {help_}"
+        yield f"# TYPE {name} gauge"
+        for pool_name, s in stats.items():
+            yield f"{name}{_braced(_labels([('pool', pool_name)]))} {s[stat]}"
+
+
+def exposition(
+    caches: Dict[str, object] = None, pools: Dict[str, object] = None
+) -> str:
+    lines = [*request_seconds.exposition(), *dependency_seconds.exposition()]
+    if caches:
+        lines.extend(cache_exposition(caches))
+    if pools:
+        lines.extend(pool_exposition(pools))
+    return "\n".join(lines) + "\n"
@@ -1,10 +1,20 @@
+import base64
 import hashlib
+import hmac
+import json
+import sys
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timezone
 from importlib import import_module
+from typing import Optional
 
 from passlib.context import CryptContext
 from toolz import keyfilter
 
+from ads_query_eval.lib.timing import timed
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
@@ -22,10 +32,12 @@ def import_via_dotted_path(dotted_path: str):
     return getattr(import_module(module_name), member_name)
 
 
+@timed("bcrypt")
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
 
+@timed("bcrypt")
 def get_password_hash(password):
     return pwd_context.hash(password)
 
@@ -34,7 +46,157 @@ def pick(whitelist, d):
     return keyfilter(lambda k: k in whitelist, d)
 
 
-def hash_of(s: str, algo="sha256") -> str:
+def _hasher(algo: str):
     if algo not in hashlib.algorithms_guaranteed:
         raise ValueError(f"desired algorithm {algo} not supported")
-    return getattr(hashlib, algo)(s.encode("utf-8")).hexdigest()
+    return getattr(hashlib, algo)()
+
+
+def hash_of(s: str, algo="sha256") -> str:
+    h = _hasher(algo)
+    h.update(s.encode("utf-8"))
+    return h.hexdigest()
+
+
+def hash_of_json(obj, algo="sha256") -> str:
+    # Equivalent to `hash_of(json.dumps(obj, sort_keys=True))`, but feeds encoder chunks
+    # to the hash as they are produced rather than building the whole string first.
+    h = _hasher(algo)
+    for chunk in json.JSONEncoder(sort_keys=True).iterencode(obj):
+        h.update(chunk.encode("utf-8"))
+    return h.hexdigest()
+
+
+def hash_of_json_array(items, algo="sha256") -> str:
+    # Equivalent to `hash_of_json(list(items))`, without building the list, so that
+    # `items` may be consumed as they are produced.
+    h = _hasher(algo)
+    h.update(b"[")
+    for n, item in enumerate(items):
+        if n:
+            h.update(b", ")
+        for chunk in json.JSONEncoder(sort_keys=True).iterencode(item):
+            h.update(chunk.encode("utf-8"))
+    h.update(b"]")
+    return h.hexdigest()
+
+
+def keyed_digest(value: str, key: str, algo="sha256") -> str:
+    return hmac.new(key.encode("utf-8"), value.encode("utf-8"), algo).hexdigest()
+
+
+def sign(value: str, key: str) -> str:
+    """Return a URL-safe token carrying `value` and its issue time, signed with `key`."""
+    payload = (
+        base64.urlsafe_b64encode(value.encode("utf-8")).decode("ascii")
+        + f".{int(time.time())}"
+    )
+    return payload + "." + keyed_digest(payload, key)
+
+
+def unsign(token: str, key: str, max_age: float) -> Optional[str]:
+    """Return the value of a `sign`ed token, or None if it is malformed, forged or expired."""
+    payload, _, signature = token.rpartition(".")
+    if not hmac.compare_digest(keyed_digest(payload, key), signature):
+        return None
+    encoded_value, _, issued_at = payload.rpartition(".")
+    try:
+        if time.time() - int(issued_at) > max_age:
+            return None
+        return base64.urlsafe_b64decode(encoded_value.encode("ascii")).decode("utf-8")
+    except ValueError:
+        return None
+
+
+def memory_size_of(obj) -> int:
+    """Estimate the bytes of memory held by `obj`, a JSON-like value: the sizes of it
+    and of the containers and scalars it holds (counting shared objects once)."""
+    seen, size, stack = set(), 0, [obj]
+    while stack:
+        o = stack.pop()
+        if id(o) in seen:
+            continue
+        seen.add(id(o))
+        size += sys.getsizeof(o)
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set)):
+            stack.extend(o)
+    return size
+
+
+class LRUCache:
+    """Thread-safe least-recently-used cache bounded by total weight, with optional TTL.
+
+    By default every entry weighs 1, so `maxsize` is an entry count.
+    Pass `weigh` (e.g. a byte-size estimate) to bound by something else.
+    """
+
+    def __init__(self, maxsize: int, ttl: float = None, weigh=lambda value: 1):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.weigh = weigh
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (value, weight, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if (
+                entry is not None
+                and entry[2] is not None
+                and entry[2] < time.monotonic()
+            ):
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, weight=None):
+        weight = self.weigh(value) if weight is None else weight
+        if weight > self.maxsize:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, weight, expires_at)
+            self.weight += weight
+            while self.weight > self.maxsize:
+                self._remove(next(iter(self._entries)))
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            return self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.weight = 0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "weight": self.weight,
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        value, weight, _ = self._entries.pop(key)
+        self.weight -= weight
+        return value
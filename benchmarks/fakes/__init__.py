@@ -0,0 +1 @@
+"""Local stand-ins for ADS, S3 and TerminusDB."""
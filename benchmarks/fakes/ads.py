@@ -0,0 +1,104 @@
+"""Local HTTP stand-in for the ADS search API, serving synthetic, deterministic,
+paginated Solr-style results with highlighting."""
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+DOCTYPES = ("article", "eprint", "inproceedings", "book")
+
+
+def synthetic_doc(q: str, rank: int, day: int = 0) -> dict:
+    """A search result for `q` at `rank`. Rankings differ slightly from `day` to day:
+    every 7th rank is taken by a document that is new that day."""
+    n = rank if rank % 7 or not day else 10_000 * day + rank
+    digest = hashlib.sha256(f"{q}:{n}".encode()).hexdigest()
+    bibcode = f"{2000 + n % 23}Fake.{digest[:4]}..{n % 1000:03d}{digest[4]}"
+    return {
+        "id": digest[:12],
+        "bibcode": bibcode,
+        "title": [f"Synthetic result {n} for {q}"],
+        "author": [f"Author, {chr(65 + i)}." for i in range(1 + n % 5)],
+        "abstract": " ".join(["Lorem ipsum dolor sit amet."] * (5 + n % 20)),
+        "[citations]": {"num_citations": n % 97, "num_references": n % 53},
+        "citation_count": n % 97,
+        "citation_count_norm": (n % 97) / 3,
+        "read_count": n % 211,
+        "doctype": DOCTYPES[n % len(DOCTYPES)],
+        "pubdate": f"{2000 + n % 23}-{1 + n % 12:02d}-00",
+    }
+
+
+def synthetic_response(q: str, start: int, rows: int, num_found: int, day: int = 0):
+    docs = [
+        synthetic_doc(q, r, day) for r in range(start, min(start + rows, num_found))
+    ]
+    return {
+        "responseHeader": {
+            "status": 0,
+            "params": {"q": q, "start": str(start), "rows": str(rows)},
+        },
+        "response": {"numFound": num_found, "start": start, "docs": docs},
+        "highlighting": {
+            d["id"]: {"abstract": [f"Lorem <em>{q}</em> ipsum"]} for d in docs
+        },
+    }
+
+
+class FakeADS:
+    """Serve `/search/query` on localhost in a background thread.
+
+    `latency` (seconds) is added to every response, to model the network and Solr.
+    """
+
+    def __init__(self, num_found: int = 5000, latency: float = 0.0, day: int = 0):
+        self.num_found = num_found
+        self.latency = latency
+        self.day = day
+        self.n_requests = 0
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                params = {
+                    k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()
+                }
+                fake.n_requests += 1
+                time.sleep(fake.latency)
+                body = json.dumps(
+                    synthetic_response(
+                        params.get("q", ""),
+                        int(params.get("start", 0)),
+                        int(params.get("rows", 10)),
+                        fake.num_found,
+                        fake.day,
+                    )
+                ).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("X-RateLimit-Limit", "5000")
+                self.send_header("X-RateLimit-Remaining", "4999")
+                self.send_header("X-RateLimit-Reset", str(int(time.time()) + 86400))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}/search/query"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
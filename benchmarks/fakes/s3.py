@@ -0,0 +1,83 @@
+"""In-process stand-in for the subset of the boto3 S3 client we use."""
+import io
+import shutil
+from collections import Counter
+
+
+class NoSuchKey(KeyError):
+    pass
+
+
+class _Paginator:
+    def __init__(self, client, page_size=1000):
+        self.client = client
+        self.page_size = page_size
+
+    def paginate(self, Bucket, Prefix=""):
+        keys = sorted(
+            k for b, k in self.client.objects if b == Bucket and k.startswith(Prefix)
+        )
+        for i in range(0, max(len(keys), 1), self.page_size):
+            yield {
+                "Contents": [
+                    {"Key": k, "Size": len(self.client.objects[Bucket, k]["Body"])}
+                    for k in keys[i : i + self.page_size]
+                ]
+            }
+
+
+class FakeS3Client:
+    class exceptions:
+        NoSuchKey = NoSuchKey
+
+    def __init__(self):
+        self.objects = {}
+        self.requests = Counter()
+
+    def _get(self, Bucket, Key):
+        try:
+            return self.objects[Bucket, Key]
+        except KeyError:
+            raise NoSuchKey(Key)
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.requests["put_object"] += 1
+        body = Body.read() if hasattr(Body, "read") else bytes(Body)
+        self.objects[Bucket, Key] = {"Body": body, **kwargs}
+
+    def get_object(self, Bucket, Key):
+        self.requests["get_object"] += 1
+        obj = self._get(Bucket, Key)
+        return {
+            **{k: v for k, v in obj.items() if k != "Body"},
+            "Body": io.BytesIO(obj["Body"]),
+            "ContentLength": len(obj["Body"]),
+        }
+
+    def head_object(self, Bucket, Key):
+        self.requests["head_object"] += 1
+        obj = self._get(Bucket, Key)
+        return {
+            **{k: v for k, v in obj.items() if k != "Body"},
+            "ContentLength": len(obj["Body"]),
+        }
+
+    def download_fileobj(self, Bucket, Key, Fileobj, **_):
+        self.requests["download_fileobj"] += 1
+        Fileobj.write(self._get(Bucket, Key)["Body"])
+
+    def download_file(self, Bucket, Key, Filename, **_):
+        self.requests["download_file"] += 1
+        with open(Filename, "wb") as f:
+            f.write(self._get(Bucket, Key)["Body"])
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None, **_):
+        self.requests["upload_file"] += 1
+        with open(Filename, "rb") as f, io.BytesIO() as body:
+            shutil.copyfileobj(f, body)
+            self.objects[Bucket, Key] = {"Body": body.getvalue(), **(ExtraArgs or {})}
+
+    def get_paginator(self, operation_name):
+        assert operation_name == "list_objects_v2"
+        self.requests["list_objects_v2"] += 1
+        return _Paginator(self)
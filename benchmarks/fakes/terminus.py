@@ -0,0 +1,407 @@
+"""In-memory stand-in for the subset of `terminusdb_client.WOQLClient` we use.
+
+Documents are validated only as far as needed to derive ids and triples from the
+schema in `ads_query_eval/frame/terminus.json`. WOQL queries are interpreted
+naively (nested-loop joins over a subject/predicate/object index), so absolute
+query times say little about TerminusDB; the per-method request counts in
+`requests` are what track round-trips.
+"""
+import hashlib
+import uuid
+from collections import Counter, defaultdict
+from datetime import date, datetime
+from itertools import islice
+from typing import NamedTuple
+from urllib.parse import quote
+
+BASE = "terminusdb:///data/"
+
+
+class Node(str):
+    pass
+
+
+class Literal(NamedTuple):
+    type: str
+    value: object
+
+
+class DocumentNotFound(KeyError):
+    pass
+
+
+class DocumentIdAlreadyExists(ValueError):
+    pass
+
+
+class SchemaCheckFailure(ValueError):
+    """A new schema that existing documents do not conform to, which TerminusDB
+    rejects."""
+
+
+def short_id(id_: str) -> str:
+    return id_[len(BASE) :] if id_.startswith(BASE) else id_
+
+
+def _plain(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+class InMemoryTerminusClient:
+    def __init__(self, schema_objects):
+        self.classes = {}
+        self.fields = {}
+        self._set_schema(schema_objects)
+        self.docs = {}
+        self.ids_by_type = defaultdict(dict)  # insertion-ordered sets of ids
+        self.spo = defaultdict(lambda: defaultdict(list))
+        self.pos = defaultdict(lambda: defaultdict(set))
+        self.requests = Counter()
+
+    # Schema
+
+    def _set_schema(self, schema_objects):
+        classes = {
+            **self.classes,
+            **{c["@id"]: c for c in schema_objects if c.get("@type") == "Class"},
+        }
+        self.fields = {name: _fields_of(classes, name) for name in classes}
+        self.classes = classes
+
+    def _replace_schema(self, schema_objects):
+        """Replace schema objects, after checking (like TerminusDB) that the
+        documents stored conform to the new schema."""
+        old_classes = self.classes
+        classes = {
+            **old_classes,
+            **{c["@id"]: c for c in schema_objects if c.get("@type") == "Class"},
+        }
+        for id_, doc in self.docs.items():
+            type_ = doc["@type"]
+            fields = _fields_of(classes, type_)
+            if classes[type_].get("@key") != old_classes[type_].get("@key"):
+                raise SchemaCheckFailure(f"{id_}: key of {type_} changed")
+            for field, spec in fields.items():
+                optional = isinstance(spec, dict) and spec.get("@type") in (
+                    "Optional",
+                    "List",
+                    "Set",
+                )
+                if field not in doc and not optional:
+                    raise SchemaCheckFailure(f"{id_}: required {field} missing")
+            for field in doc:
+                if not field.startswith("@") and field not in fields:
+                    raise SchemaCheckFailure(f"{id_}: {field} not in schema")
+        self._set_schema(schema_objects)
+
+    def _field_kind(self, class_name, field):
+        """Return (container, kind, target) for a field of a class."""
+        spec = self.fields[class_name].get(field)
+        container = None
+        if isinstance(spec, dict) and spec["@type"] in ("Optional", "List", "Set"):
+            container, spec = spec["@type"], spec["@class"]
+        if isinstance(spec, dict) and spec["@type"] == "Enum":
+            return container, "enum", spec["@id"]
+        if spec in self.classes:
+            return container, "ref", spec
+        if spec == "sys:JSON":
+            return container, "json", spec
+        return container, "literal", spec
+
+    def _id_for(self, doc):
+        if doc.get("@id"):
+            return short_id(doc["@id"])
+        type_ = doc["@type"]
+        key = self.classes[type_].get("@key", {"@type": "Random"})
+        if key["@type"] == "Random":
+            return f"{type_}/{uuid.uuid4().hex}"
+        parts = [
+            quote(str(self._ref_or_value(doc[f])), safe="") for f in key["@fields"]
+        ]
+        if key["@type"] == "Lexical":
+            return f"{type_}/{'+'.join(parts)}"
+        return f"{type_}/{hashlib.sha256('+'.join(parts).encode()).hexdigest()}"
+
+    def _ref_or_value(self, value):
+        if isinstance(value, dict) and "@type" in value:
+            return self._id_for(value)
+        return short_id(value) if isinstance(value, str) else _plain(value)
+
+    # Storage and indexing
+
+    def _normalized(self, doc, create_nested):
+        """Return a stored form of `doc`: short reference ids, plain values, and
+        nested documents replaced by their ids (after storing them)."""
+        type_ = doc["@type"]
+        stored = {"@id": self._id_for(doc), "@type": type_}
+        for field, value in doc.items():
+            if field.startswith("@") or value is None:
+                continue
+            container, kind, _ = self._field_kind(type_, field)
+            values = value if container in ("List", "Set") else [value]
+            out = []
+            for v in values:
+                if kind == "ref":
+                    if isinstance(v, dict):
+                        if create_nested:
+                            self._store(v, replace=True)
+                        v = self._id_for(v)
+                    v = short_id(v)
+                elif kind == "literal" and self.fields[type_][field] == "xsd:boolean":
+                    v = v in (True, "true")
+                out.append(_plain(v))
+            stored[field] = out if container in ("List", "Set") else out[0]
+        return stored
+
+    def _triples(self, doc):
+        type_ = doc["@type"]
+        yield "rdf:type", Node(f"@schema:{type_}")
+        for field, value in doc.items():
+            if field.startswith("@"):
+                continue
+            container, kind, target = self._field_kind(type_, field)
+            if container == "List" or kind == "json":
+                continue  # lists are cons cells in TerminusDB; not modelled here
+            for v in value if container == "Set" else [value]:
+                if kind == "ref":
+                    yield field, Node(v)
+                elif kind == "enum":
+                    yield field, Node(f"@schema:{target}/{quote(v)}")
+                else:
+                    yield field, Literal(target, v)
+
+    def _index(self, doc, add=True):
+        s = doc["@id"]
+        for p, o in self._triples(doc):
+            if add:
+                self.spo[s][p].append(o)
+                self.pos[p][_key(o)].add(s)
+            else:
+                self.spo[s].pop(p, None)
+                self.pos[p][_key(o)].discard(s)
+
+    def _store(self, doc, replace):
+        stored = self._normalized(doc, create_nested=True)
+        id_ = stored["@id"]
+        if id_ in self.docs:
+            if not replace:
+                raise DocumentIdAlreadyExists(id_)
+            self._index(self.docs[id_], add=False)
+        self.docs[id_] = stored
+        self.ids_by_type[stored["@type"]][id_] = None
+        self._index(stored)
+        return BASE + id_
+
+    # Document API
+
+    def insert_document(self, document, commit_msg=None, graph_type="instance", **_):
+        self.requests["insert_document"] += 1
+        docs = document if isinstance(document, list) else [document]
+        for doc in docs:
+            if self._id_for(doc) in self.docs:
+                raise DocumentIdAlreadyExists(self._id_for(doc))
+        return [self._store(doc, replace=False) for doc in docs]
+
+    def replace_document(
+        self, document, commit_msg=None, graph_type="instance", create=False, **_
+    ):
+        self.requests["replace_document"] += 1
+        docs = document if isinstance(document, list) else [document]
+        if graph_type == "schema":
+            return self._replace_schema(docs)
+        for doc in docs:
+            if not create and self._id_for(doc) not in self.docs:
+                raise DocumentNotFound(self._id_for(doc))
+        return [self._store(doc, replace=True) for doc in docs]
+
+    def update_document(self, document, commit_msg=None, graph_type="instance", **_):
+        self.requests["update_document"] += 1
+        docs = document if isinstance(document, list) else [document]
+        return [self._store(doc, replace=True) for doc in docs]
+
+    # Database admin, with a single database
+
+    def connect(self, **_):
+        pass
+
+    def has_database(self, dbid, **_):
+        return True
+
+    def get_document(self, iri_id, **_):
+        self.requests["get_document"] += 1
+        try:
+            return dict(self.docs[short_id(iri_id)])
+        except KeyError:
+            raise DocumentNotFound(iri_id)
+
+    def get_documents_by_type(self, doc_type, as_list=False, **_):
+        self.requests["get_documents_by_type"] += 1
+        docs = [dict(self.docs[i]) for i in self.ids_by_type[doc_type]]
+        return docs if as_list else iter(docs)
+
+    def query_document(self, document_template, count=None, as_list=False, **_):
+        self.requests["query_document"] += 1
+        template = self._normalized(
+            {"@id": "_", **document_template}, create_nested=False
+        )
+        del template["@id"]
+        ids = self.ids_by_type[template["@type"]]
+        if "@id" in document_template:
+            ids = [short_id(document_template["@id"])]
+        matches = (
+            dict(self.docs[i])
+            for i in ids
+            if i in self.docs
+            and all(self.docs[i].get(k) == v for k, v in template.items())
+        )
+        matches = list(islice(matches, count))
+        return matches if as_list else iter(matches)
+
+    # WOQL
+
+    def query(self, woql_query, commit_msg=None, file_dict=None):
+        self.requests["query"] += 1
+        q = woql_query.to_dict() if hasattr(woql_query, "to_dict") else woql_query
+        return {
+            "bindings": [
+                {k: self._output(v) for k, v in b.items()} for b in self._eval(q, {})
+            ]
+        }
+
+    def _output(self, value):
+        if isinstance(value, Literal):
+            return {"@type": value.type, "@value": value.value}
+        if isinstance(value, dict):
+            return dict(value)
+        return str(value)
+
+    def _value(self, spec, b):
+        if "variable" in spec:
+            return b.get(spec["variable"])
+        if "node" in spec:
+            node = spec["node"]
+            return Node(node if node.startswith("@schema:") else short_id(node))
+        data = spec["data"]
+        return Literal(data["@type"], _plain(data["@value"]))
+
+    def _unify(self, spec, value, b):
+        current = self._value(spec, b)
+        if current is None:
+            return {**b, spec["variable"]: value}
+        return b if _key(current) == _key(value) else None
+
+    def _eval(self, q, b):
+        kind = q["@type"]
+        if kind == "And":
+            solutions = [b]
+            for sub in q["and"]:
+                solutions = [s2 for s in solutions for s2 in self._eval(sub, s)]
+            yield from solutions
+        elif kind == "Or":
+            for sub in q["or"]:
+                yield from self._eval(sub, b)
+        elif kind == "Optional":
+            solutions = list(self._eval(q["query"], b))
+            yield from solutions or [b]
+        elif kind == "Not":
+            if next(self._eval(q["query"], b), None) is None:
+                yield b
+        elif kind == "Limit":
+            yield from islice(self._eval(q["query"], b), q["limit"])
+        elif kind == "Start":
+            yield from islice(self._eval(q["query"], b), q["start"], None)
+        elif kind == "OrderBy":
+            solutions = list(self._eval(q["query"], b))
+            for template in reversed(q["ordering"]):
+                solutions.sort(
+                    key=lambda s: _sort_key(s.get(template["variable"])),
+                    reverse=template["order"] == "desc",
+                )
+            yield from solutions
+        elif kind == "Count":
+            n = sum(1 for _ in self._eval(q["query"], b))
+            b2 = self._unify(q["count"], Literal("xsd:decimal", n), b)
+            if b2 is not None:
+                yield b2
+        elif kind == "Distinct":
+            seen = set()
+            for s in self._eval(q["query"], b):
+                key = tuple(_key(s.get(v)) for v in q["variables"])
+                if key not in seen:
+                    seen.add(key)
+                    yield s
+        elif kind == "Select":
+            for s in self._eval(q["query"], b):
+                yield {v: s[v] for v in q["variables"] if v in s}
+        elif kind == "Equals":
+            left, right = self._value(q["left"], b), self._value(q["right"], b)
+            if left is None:
+                yield {**b, q["left"]["variable"]: right}
+            elif right is None:
+                yield {**b, q["right"]["variable"]: left}
+            elif _key(left) == _key(right):
+                yield b
+        elif kind in ("Less", "Greater"):
+            left, right = self._value(q["left"], b), self._value(q["right"], b)
+            if (kind == "Less") == (_sort_key(left) < _sort_key(right)) and (
+                _sort_key(left) != _sort_key(right)
+            ):
+                yield b
+        elif kind == "ReadDocument":
+            id_ = self._value(q["identifier"], b)
+            if id_ in self.docs:
+                b2 = self._unify(q["document"], dict(self.docs[id_]), b)
+                if b2 is not None:
+                    yield b2
+        elif kind == "Triple":
+            yield from self._eval_triple(q, b)
+        else:
+            raise NotImplementedError(f"WOQL {kind} is not supported")
+
+    def _eval_triple(self, q, b):
+        p = q["predicate"]["node"].removeprefix("@schema:")
+        s, o = self._value(q["subject"], b), self._value(q["object"], b)
+        if s is not None:
+            candidates = ((s, o2) for o2 in self.spo.get(s, {}).get(p, ()))
+        elif o is not None:
+            candidates = ((s2, o) for s2 in list(self.pos[p].get(_key(o), ())))
+        else:
+            candidates = (
+                (s2, o2)
+                for subjects in list(self.pos[p].values())
+                for s2 in subjects
+                for o2 in self.spo[s2][p]
+            )
+        for s2, o2 in candidates:
+            b2 = self._unify(q["subject"], Node(s2), b)
+            if b2 is not None:
+                b2 = self._unify(q["object"], o2, b2)
+            if b2 is not None:
+                yield b2
+
+
+def _fields_of(classes, class_name):
+    cls = classes[class_name]
+    fields = {}
+    for parent in cls.get("@inherits", []):
+        fields.update(_fields_of(classes, parent))
+    fields.update({k: v for k, v in cls.items() if not k.startswith("@")})
+    return fields
+
+
+def _key(value):
+    if isinstance(value, Literal):
+        return ("literal", value.value)
+    if isinstance(value, dict):
+        return ("document", value.get("@id"))
+    return ("node", value)
+
+
+def _sort_key(value):
+    if value is None:
+        return (0, "")
+    if isinstance(value, Literal):
+        return (1, value.value)
+    return (2, str(value))
@@ -0,0 +1,358 @@
+"""Time hot code paths against local stand-ins for ADS, S3 and TerminusDB.
+
+    python -m benchmarks.run                        # all benchmarks, all scales
+    python -m benchmarks.run --only routes --scales 1000 10000
+    python -m benchmarks.run --record --compare     # track regressions
+
+Scales are numbers of completed evaluations seeded before timing the app routes.
+With `--record`, results are appended to `benchmarks/results.jsonl`; `--compare`
+prints each median against that of the last recorded run.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import date, timedelta
+from pathlib import Path
+from urllib.parse import quote
+
+from benchmarks.fakes.ads import FakeADS, synthetic_response
+
+RESULTS_PATH = Path(__file__).resolve().parent / "results.jsonl"
+SCHEMA_PATH = (
+    Path(__file__).resolve().parent.parent
+    / "ads_query_eval"
+    / "frame"
+    / "terminus.json"
+)
+BENCHMARKS = ("fetch", "retrieval", "routes")
+PASSWORD = "benchmark-password"
+
+
+def configure_environment(ads_url: str, tmp_dir: str):
+    """Point the package at the stand-ins. Must run before it is imported, since
+    configuration is read at import time."""
+    os.environ.update(
+        {
+            "ADS_API_QUERY_BASE_URL": ads_url,
+            "ADS_API_TOKEN": "benchmark",
+            "ADS_API_RATE_LIMIT_DB": str(Path(tmp_dir) / "ratelimit.sqlite3"),
+            "ADS_API_RATE_PER_SECOND": "1000000",
+            "ADS_API_RATE_BURST": "1000000",
+            "ADS_API_CACHE_DB": str(Path(tmp_dir) / "cache.sqlite3"),
+            "ADS_API_CACHE_TTL_SEARCH": "0",
+            "S3_BUCKET": "benchmark",
+            "S3_PREFIX": "benchmark/",
+            "HISTORY_LOCAL_DIR": str(Path(tmp_dir) / "history"),
+            "SECRET_KEY": "benchmark",
+            "ADMINS": "user0@example.com",
+        }
+    )
+
+
+def new_terminus_client():
+    from benchmarks.fakes.terminus import InMemoryTerminusClient
+
+    # Not via `get_terminus_config`, which waits for a TerminusDB server.
+    with SCHEMA_PATH.open() as f:
+        return InMemoryTerminusClient(json.load(f))
+
+
+def timed(fn, repeat: int, counters=(), warmup: int = 1) -> dict:
+    """Call `fn` `warmup` + `repeat` times; summarize the timed calls, and the mean
+    number of requests per call made to each of `counters`."""
+    for _ in range(warmup):
+        fn()
+    before = [Counter(c.requests) for c in counters]
+    seconds = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        seconds.append(time.perf_counter() - t0)
+    seconds.sort()
+    return {
+        "n": repeat,
+        "min_s": seconds[0],
+        "median_s": statistics.median(seconds),
+        "p95_s": seconds[min(len(seconds) - 1, round(0.95 * (len(seconds) - 1)))],
+        "requests_per_call": {
+            f"{type(c).__name__}.{method}": n / repeat
+            for c, b in zip(counters, before)
+            for method, n in (Counter(c.requests) - b).items()
+        },
+    }
+
+
+def bench_fetch(args, ads: FakeADS) -> dict:
+    from ads_query_eval.lib.io import fetch_first_n
+
+    results = {}
+    for label, max_workers in (("sequential", 1), ("concurrent", None)):
+        results[f"fetch_first_n[{label}]"] = timed(
+            lambda: fetch_first_n("fetch benchmark", n=1000, max_workers=max_workers),
+            args.repeat,
+        )
+    return results
+
+
+def bench_retrieval(args, ads: FakeADS) -> dict:
+    from dagster import build_op_context
+
+    from ads_query_eval.frame.dagster import (
+        format_query_retrieval_for_evaluation,
+        retrieval_op,
+    )
+    from benchmarks.fakes.s3 import FakeS3Client
+
+    query_literal = "retrieval benchmark"
+    timings = {"retrieval_op": [], "format_query_retrieval_for_evaluation": []}
+    for _ in range(args.repeat):
+        terminus_client, s3_client = new_terminus_client(), FakeS3Client()
+        terminus_client.insert_document(
+            {"@type": "Query", "query_literal": query_literal}
+        )
+        context = build_op_context(
+            resources={"terminus": terminus_client, "s3": s3_client}
+        )
+        t0 = time.perf_counter()
+        out = retrieval_op(context, {"query_literal": query_literal, "date": None})
+        t1 = time.perf_counter()
+        format_query_retrieval_for_evaluation(context, out)
+        t2 = time.perf_counter()
+        timings["retrieval_op"].append(t1 - t0)
+        timings["format_query_retrieval_for_evaluation"].append(t2 - t1)
+    return {
+        name: {
+            "n": len(seconds),
+            "min_s": min(seconds),
+            "median_s": statistics.median(seconds),
+            "p95_s": max(seconds),
+        }
+        for name, seconds in timings.items()
+    }
+
+
+def seed(terminus_client, s3_client, n_evaluations: int, args) -> dict:
+    """Seed queries, daily retrievals with their items, users and completed
+    evaluations. Returns what the route benchmarks request."""
+    from ads_query_eval.app.rendering import render_eval_form_items
+    from ads_query_eval.frame import s3
+    from ads_query_eval.frame.models import RetrievedItemContent
+    from ads_query_eval.lib.io import write_retrieved_items
+    from ads_query_eval.lib.util import get_password_hash
+
+    query_literals = [f"benchmark query {i}" for i in range(args.queries)]
+    query_ids = terminus_client.insert_document(
+        [{"@type": "Query", "query_literal": q} for q in query_literals]
+    )
+    users = [
+        {
+            "@type": "User",
+            "username": f"user{i}",
+            "email_address": f"user{i}@example.com",
+            "hashed_password": get_password_hash(PASSWORD),
+        }
+        for i in range(args.users)
+    ]
+    user_ids = terminus_client.insert_document(users)
+
+    retrievals = []
+    for q, query_id in zip(query_literals, query_ids):
+        for day in range(args.days):
+            yyyy_mm_dd = (date(2022, 12, 1) + timedelta(days=day)).isoformat()
+            s3_key = f"{q}.{yyyy_mm_dd}.json.gz"
+            [retrieval_id] = terminus_client.insert_document(
+                {
+                    "@type": "Retrieval",
+                    "query": query_id,
+                    "s3_key": s3_key,
+                    "status": "completed",
+                    "done": True,
+                    "done_at": f"{yyyy_mm_dd}T10:00:00+00:00",
+                    "items": [],
+                }
+            )
+            retrieval_id = retrieval_id.rpartition("/data/")[-1]
+            docs = synthetic_response(q, 0, args.items_per_retrieval, 10**6, day)[
+                "response"
+            ]["docs"]
+            item_ids = write_retrieved_items(
+                terminus_client,
+                retrieval_id,
+                [d["bibcode"] for d in docs],
+                chunk_size=1000,
+            )
+            doc = terminus_client.get_document(retrieval_id)
+            terminus_client.replace_document(
+                {**doc, "items": item_ids, "n_items": len(item_ids)}
+            )
+            items_top25 = [
+                {**d, "retrieved_item": i} for d, i in zip(docs[:25], item_ids)
+            ]
+            s3.put_json(s3_client, "items_top25__" + s3_key, items_top25)
+            s3.put_json(
+                s3_client,
+                "eval_form_items__" + s3_key,
+                render_eval_form_items(
+                    [RetrievedItemContent(**c) for c in items_top25], item_ids[:25]
+                ),
+            )
+            retrievals.append((retrieval_id, s3_key, item_ids))
+
+    batch = []
+    for n in range(n_evaluations):
+        retrieval_id, _, item_ids = retrievals[n % len(retrievals)]
+        eval_id = f"Evaluation/benchmark{n}"
+        batch.append(
+            {
+                "@type": "Evaluation",
+                "@id": eval_id,
+                "retrieval": retrieval_id,
+                "evaluator": user_ids[n % len(user_ids)],
+                "status": "completed",
+                "done": True,
+                "done_at": "2022-12-31T12:00:00+00:00",
+            }
+        )
+        batch.extend(
+            {
+                "@type": "ItemOfEvaluation",
+                "evaluation": eval_id,
+                "retrieved_item": item_id,
+                "evaluation_status": "done",
+                "uncertainty": "low",
+                "relevance": "relevant" if (n + k) % 3 else "not relevant",
+            }
+            for k, item_id in enumerate(item_ids[: args.items_per_evaluation])
+        )
+        if len(batch) >= 10_000:
+            terminus_client.insert_document(batch)
+            batch = []
+    if batch:
+        terminus_client.insert_document(batch)
+    return {"query_literal": query_literals[0], "s3_key": retrievals[0][1]}
+
+
+def bench_routes(args, ads: FakeADS) -> dict:
+    from fastapi.testclient import TestClient
+
+    from ads_query_eval.app import main
+    from ads_query_eval.lib.pool import ClientPool
+    from benchmarks.fakes.s3 import FakeS3Client
+
+    results = {}
+    for scale in args.scales:
+        terminus_client, s3_client = new_terminus_client(), FakeS3Client()
+        terminus_pool = ClientPool(lambda: terminus_client, maxsize=16, name="terminus")
+        t0 = time.perf_counter()
+        seeded = seed(terminus_client, s3_client, scale, args)
+        print(f"seeded {scale} evaluations in {time.perf_counter() - t0:.1f}s")
+        main.get_terminus_pool = lambda: terminus_pool
+        main.get_s3_client = lambda: s3_client
+        main.verified_users.clear()
+        main.eval_form_items.clear()
+
+        client = TestClient(main.app)
+        # Like a browser: resend Basic credentials, and the session cookie once set.
+        client.auth = ("user0", PASSWORD)
+        paths = {
+            "GET /": "/",
+            "GET /Query/{query_literal}": f"/Query/{quote(seeded['query_literal'], safe='')}",
+            "GET /Retrieval/{id}": f"/Retrieval/{quote(seeded['s3_key'], safe='')}",
+            "GET /Retrieval/{id}/Evaluation": (
+                f"/Retrieval/{quote(seeded['s3_key'], safe='')}/Evaluation"
+            ),
+            "GET /user_completed_evals/all?format=ndjson&limit=1000": (
+                "/user_completed_evals/all?format=ndjson&limit=1000"
+            ),
+            "GET /user_completed_evals/summary": "/user_completed_evals/summary",
+        }
+        for name, path in paths.items():
+
+            def get():
+                response = client.get(path)
+                assert response.status_code == 200, (path, response.status_code)
+
+            results[f"{name}[{scale}]"] = timed(
+                get, args.repeat, counters=(terminus_client, s3_client)
+            )
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def last_recorded() -> dict:
+    if not RESULTS_PATH.exists():
+        return {}
+    lines = RESULTS_PATH.read_text().splitlines()
+    return json.loads(lines[-1])["results"] if lines else {}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, default=BENCHMARKS)
+    parser.add_argument("--scales", nargs="+", type=int, default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--ads-latency", type=float, default=0.05, help="seconds")
+    parser.add_argument("--queries", type=int, default=10)
+    parser.add_argument("--days", type=int, default=5, help="retrievals per query")
+    parser.add_argument("--items-per-retrieval", type=int, default=1000)
+    parser.add_argument("--items-per-evaluation", type=int, default=3)
+    parser.add_argument("--users", type=int, default=5)
+    parser.add_argument("--record", action="store_true")
+    parser.add_argument("--compare", action="store_true")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp_dir, FakeADS(
+        latency=args.ads_latency
+    ) as ads:
+        configure_environment(ads.url, tmp_dir)
+        results = {}
+        for name in args.only:
+            results.update(globals()[f"bench_{name}"](args, ads))
+
+    previous = last_recorded() if args.compare else {}
+    for name, r in results.items():
+        line = f"{name:70s} median {r['median_s'] * 1000:9.1f} ms"
+        if name in previous:
+            line += (
+                f"  ({r['median_s'] / previous[name]['median_s']:.2f}x last recorded)"
+            )
+        print(line)
+        for counter, n in sorted(r.get("requests_per_call", {}).items()):
+            print(f"    {counter}: {n:g}/call")
+
+    if args.record:
+        with RESULTS_PATH.open("a") as f:
+            record = {
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "git_commit": git_commit(),
+                "python": platform.python_version(),
+                "args": {
+                    k: v
+                    for k, v in vars(args).items()
+                    if k not in ("record", "compare")
+                },
+                "results": results,
+            }
+            f.write(json.dumps(record) + "\n")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,56 @@
+"""Verifying users by their session token or Basic credentials, against the in-memory
+stand-in for TerminusDB."""
+import pytest
+from fastapi.security import HTTPBasicCredentials
+
+from ads_query_eval.app import main
+from ads_query_eval.lib.util import get_password_hash, sign
+from benchmarks.run import new_terminus_client
+
+PASSWORD = "correct horse battery staple"
+
+
+@pytest.fixture
+def client():
+    client = new_terminus_client()
+    client.insert_document(
+        {
+            "@type": "User",
+            "username": "user0",
+            "email_address": "user0@example.com",
+            "hashed_password": get_password_hash(PASSWORD),
+        }
+    )
+    main.verified_users.clear()
+    yield client
+    main.verified_users.clear()
+
+
+def session_token(user: dict) -> str:
+    return sign(
+        f"{user['username']}:{main._password_fingerprint(user)}",
+        main.auth_config["secret_key"],
+    )
+
+
+def test_session_user_is_cached(client):
+    token = session_token(client.get_document("User/user0"))
+    assert main._session_user(token, client)["username"] == "user0"
+    n_queries = client.requests["query_document"]
+    assert main._session_user(token, client)["username"] == "user0"
+    assert client.requests["query_document"] == n_queries
+
+
+def test_password_is_verified_after_session_user_is_cached(client):
+    main._session_user(session_token(client.get_document("User/user0")), client)
+    wrong = HTTPBasicCredentials(username="user0", password="wrong")
+    right = HTTPBasicCredentials(username="user0", password=PASSWORD)
+    assert main._verified_user(wrong, client) is None
+    assert main._verified_user(right, client)["username"] == "user0"
+
+
+def test_session_signed_with_a_reset_password_is_rejected(client):
+    user = client.get_document("User/user0")
+    token = session_token(user)
+    client.replace_document({**user, "hashed_password": get_password_hash("new")})
+    assert main._session_user(token, client) is None
@@ -0,0 +1,151 @@
+"""Paging through the items of completed evaluations, against the in-memory stand-in
+for TerminusDB (which orders and compares `xsd:dateTime`s as the server would
+order and compare them, if they share a format)."""
+from unittest import mock
+
+import pytest
+
+from ads_query_eval.app import main
+from ads_query_eval.lib.io import write_retrieved_items
+from benchmarks.run import new_terminus_client
+
+BIBCODES = ["2021LRSP...18....3V", "2007LRSP....4....1P", "2015SSRv..190....1K"]
+# Evaluations 2, 3 and 4 were done at the same time, so are ordered by id.
+DONE_AT = {
+    1: "2022-12-01T10:00:00+00:00",
+    2: "2022-12-02T10:00:00+00:00",
+    3: "2022-12-02T10:00:00+00:00",
+    4: "2022-12-02T10:00:00+00:00",
+    5: "2022-12-03T10:00:00+00:00",
+    6: "2022-12-04T10:00:00+00:00",
+}
+
+
+@pytest.fixture
+def client():
+    client = new_terminus_client()
+    [query_id] = client.insert_document(
+        {"@type": "Query", "query_literal": "full:substorm"}
+    )
+    [user_id] = client.insert_document(
+        {
+            "@type": "User",
+            "username": "user0",
+            "email_address": "user0@example.com",
+            "hashed_password": "x",
+        }
+    )
+    [retrieval_id] = client.insert_document(
+        {
+            "@type": "Retrieval",
+            "query": query_id,
+            "s3_key": "full:substorm.2022-12-01.json.gz",
+            "done": True,
+            "status": "completed",
+            "items": [],
+        }
+    )
+    retrieval_id = retrieval_id.rpartition("/data/")[-1]
+    item_ids = write_retrieved_items(client, retrieval_id, BIBCODES)
+    for n, done_at in [*reversed(DONE_AT.items()), (7, None)]:
+        client.insert_document(
+            {
+                "@type": "Evaluation",
+                "@id": f"Evaluation/{n}",
+                "retrieval": retrieval_id,
+                "evaluator": user_id,
+                "status": "completed" if done_at else "started",
+                "done": done_at is not None,
+                **({"done_at": done_at} if done_at else {}),
+            }
+        )
+        client.insert_document(
+            [
+                {
+                    "@type": "ItemOfEvaluation",
+                    "evaluation": f"Evaluation/{n}",
+                    "retrieved_item": item_id,
+                    "evaluation_status": "done",
+                    "uncertainty": "low",
+                    "relevance": "not relevant" if k else "relevant",
+                }
+                # Evaluation n has n % 3 + 1 items.
+                for k, item_id in enumerate(item_ids[: n % 3 + 1])
+            ]
+        )
+    return client
+
+
+def all_rows(client):
+    return list(main._iter_completed_eval_items(client))
+
+
+def test_rows_are_in_order_of_completion(client):
+    rows = all_rows(client)
+    assert [r["evaluation"] for r in rows] == [
+        f"Evaluation/{n}" for n in DONE_AT for _ in range(n % 3 + 1)
+    ]
+    row = next(r for r in rows[:2] if r["ads_bibcode"] == BIBCODES[0])
+    assert row == {
+        "evaluation": "Evaluation/1",
+        "done_at": DONE_AT[1],
+        "believed_query_intent": None,
+        "evaluator": "User/user0",
+        "evaluator_email": "user0@example.com",
+        "retrieval": "Retrieval/full%3Asubstorm.2022-12-01.json.gz",
+        "query_literal": "full:substorm",
+        "retrieved_item": row["retrieved_item"],
+        "ads_bibcode": BIBCODES[0],
+        "relevance": "relevant",
+        "uncertainty": "low",
+        "evaluation_status": "done",
+    }
+    assert {r["relevance"] for r in rows[:2]} == {"relevant", "not relevant"}
+
+
+@pytest.mark.parametrize("evaluations_page_size", [1, 2, 4, 100])
+def test_streamed_rows_do_not_depend_on_page_size(client, evaluations_page_size):
+    expected = all_rows(client)
+    with mock.patch.object(
+        main, "COMPLETED_EVALUATIONS_PAGE_SIZE", evaluations_page_size
+    ):
+        assert all_rows(client) == expected
+        assert list(main._iter_completed_eval_items(client, 2, 5)) == expected[2:7]
+
+
+@pytest.mark.parametrize("evaluations_page_size", [1, 2, 100])
+@pytest.mark.parametrize("limit", [1, 3, 4, 100])
+def test_pages_resume_after_their_cursor(client, evaluations_page_size, limit):
+    expected = all_rows(client)
+    pages, after = [], None
+    with mock.patch.object(
+        main, "COMPLETED_EVALUATIONS_PAGE_SIZE", evaluations_page_size
+    ):
+        while True:
+            rows, after = main._completed_eval_items_page(client, limit, after=after)
+            pages.append(rows)
+            if after is None:
+                break
+    assert [r for rows in pages for r in rows] == expected
+    for rows in pages:
+        # Pages end at whole evaluations, so exceed `limit` only with one of them.
+        assert len(rows) <= limit or len({r["evaluation"] for r in rows}) == 1
+
+
+def test_cursor_skips_evaluations_done_at_the_same_time(client):
+    rows, after = main._completed_eval_items_page(client, 4)
+    assert [r["evaluation"] for r in rows] == ["Evaluation/1", "Evaluation/1"]
+    assert after == f"{DONE_AT[1]}|1"
+    rows, after = main._completed_eval_items_page(client, 4, after=after)
+    assert {r["evaluation"] for r in rows} == {"Evaluation/2", "Evaluation/3"}
+    assert after == f"{DONE_AT[2]}|2"
+    rows, _ = main._completed_eval_items_page(client, 1, after=after)
+    assert {r["evaluation"] for r in rows} == {"Evaluation/4"}
+
+
+@pytest.mark.parametrize("after", ["", "2022-12-01", "2022-12-01|x"])
+def test_invalid_cursor_is_rejected(client, after):
+    with pytest.raises(main.HTTPException):
+        main._completed_eval_items_page(client, 4, after=after)
+    with pytest.raises(main.HTTPException):
+        main._iter_completed_eval_items(client, after=after)
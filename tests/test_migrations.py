@@ -0,0 +1,133 @@
+"""Bootstrapping and migrating a database with RetrievedItems written before
+RetrievableItems existed, against the in-memory stand-in for TerminusDB (which, like
+TerminusDB, rejects a schema that stored documents do not conform to)."""
+import json
+from unittest import mock
+
+import pytest
+
+from ads_query_eval.app import bootstrap
+from ads_query_eval.frame.migrations import migrate_retrievable_items
+from ads_query_eval.lib.io import write_retrieved_items
+from benchmarks.fakes.terminus import InMemoryTerminusClient, SchemaCheckFailure
+from benchmarks.run import SCHEMA_PATH
+
+LEGACY_RETRIEVED_ITEM = {
+    "@type": "Class",
+    "@id": "RetrievedItem",
+    "@key": {"@type": "Hash", "@fields": ["ads_bibcode", "retrieval"]},
+    "ads_bibcode": "xsd:string",
+    "retrieval": "Retrieval",
+}
+BIBCODES = ["2021LRSP...18....3V", "2007LRSP....4....1P", "2015SSRv..190....1K"]
+
+
+def schema_objects():
+    with SCHEMA_PATH.open() as f:
+        return json.load(f)
+
+
+def legacy_schema_objects():
+    return [
+        LEGACY_RETRIEVED_ITEM if obj.get("@id") == "RetrievedItem" else obj
+        for obj in schema_objects()
+        if obj.get("@id") not in ("RetrievableItem", "BootstrapState")
+    ]
+
+
+@pytest.fixture
+def client():
+    client = InMemoryTerminusClient(legacy_schema_objects())
+    client.insert_document({"@type": "Query", "query_literal": "full:substorm"})
+    client.insert_document(
+        {
+            "@type": "Retrieval",
+            "query": "Query/full%3Asubstorm",
+            "s3_key": "full:substorm.2022-12-01.json.gz",
+            "done": True,
+            "status": "completed",
+            "items": [],
+        }
+    )
+    item_ids = [
+        client.insert_document(
+            {
+                "@type": "RetrievedItem",
+                "ads_bibcode": b,
+                "retrieval": "Retrieval/full%3Asubstorm.2022-12-01.json.gz",
+            }
+        )[0]
+        for b in BIBCODES
+    ]
+    client.replace_document(
+        {
+            **client.get_document("Retrieval/full%3Asubstorm.2022-12-01.json.gz"),
+            "items": [i.rpartition("/data/")[-1] for i in item_ids],
+        }
+    )
+    client.insert_document(
+        {
+            "@type": "ItemOfEvaluation",
+            "evaluation": "Evaluation/1",
+            "retrieved_item": item_ids[1].rpartition("/data/")[-1],
+            "evaluation_status": "done",
+            "uncertainty": "low",
+            "relevance": "relevant",
+        }
+    )
+    return client
+
+
+def run_bootstrap(client, objects):
+    config = {
+        "schema_objects": objects,
+        "force_reset_on_init": False,
+        "reset_schema": False,
+        "server_url": "http://terminusdb:6363",
+        "admin_pass": "root",
+        "dbid": "test_migrations",
+    }
+    with mock.patch.object(
+        bootstrap, "get_terminus_config", return_value=config
+    ), mock.patch.object(
+        bootstrap, "WOQLClient", return_value=client
+    ), mock.patch.object(
+        bootstrap, "get_terminus_client", return_value=client
+    ), mock.patch.object(
+        bootstrap, "_bootstrapped", False
+    ):
+        bootstrap.bootstrap()
+
+
+def test_bootstrap_then_migration_links_legacy_items(client):
+    retrieval_id = "Retrieval/full%3Asubstorm.2022-12-01.json.gz"
+    item_ids = client.get_document(retrieval_id)["items"]
+
+    run_bootstrap(client, schema_objects())
+    assert migrate_retrievable_items(client) == len(BIBCODES)
+
+    for rank, (item_id, bibcode) in enumerate(zip(item_ids, BIBCODES)):
+        item = client.get_document(item_id)
+        assert item["rank"] == rank
+        assert client.get_document(item["retrievable_item"])["ads_bibcode"] == bibcode
+    [ioe] = client.get_documents_by_type("ItemOfEvaluation")
+    assert ioe["retrieved_item"] == item_ids[1]
+    assert migrate_retrievable_items(client) == 0
+    writes = client.requests["replace_document"]
+    assert write_retrieved_items(client, retrieval_id, BIBCODES) == item_ids
+    assert client.requests["replace_document"] == writes
+
+
+def test_schema_keyed_on_rank_is_rejected_while_items_are_keyed_on_bibcode(client):
+    run_bootstrap(client, schema_objects())
+    migrate_retrievable_items(client)
+    keyed_on_rank = {
+        "@type": "Class",
+        "@id": "RetrievedItem",
+        "@key": {"@type": "Hash", "@fields": ["retrieval", "rank"]},
+        "retrieval": "Retrieval",
+        "retrievable_item": "RetrievableItem",
+        "rank": "xsd:integer",
+    }
+    with pytest.raises(SchemaCheckFailure):
+        client.replace_document([keyed_on_rank], graph_type="schema", create=True)
@@ -0,0 +1,46 @@
+"""Reading JSON from S3, against the in-memory stand-in for S3."""
+from unittest import mock
+
+import pytest
+
+from ads_query_eval.frame import s3
+from ads_query_eval.lib.io import digest_of_responses
+from ads_query_eval.lib.util import hash_of_json
+from benchmarks.fakes.ads import synthetic_response
+from benchmarks.fakes.s3 import FakeS3Client
+
+RESPONSES = [
+    synthetic_response("full:substorm", start, 10, 100, 0) for start in (0, 10)
+]
+
+
+@pytest.fixture(params=["with ijson", "without ijson"])
+def client(request):
+    if request.param == "with ijson":
+        pytest.importorskip("ijson")
+    config = {"s3_bucket": "test", "s3_prefix": "test/", "s3_json_codec": "gzip"}
+    with mock.patch.dict(s3.s3_config, config):
+        if request.param == "with ijson":
+            yield FakeS3Client()
+        else:
+            with mock.patch.object(s3, "ijson", None):
+                yield FakeS3Client()
+
+
+@pytest.mark.parametrize("codec", ["gzip", "identity"])
+def test_iter_json_yields_the_elements_parsed_by_get_json(client, codec):
+    s3.put_json(client, "responses.json", RESPONSES, codec=codec)
+    assert list(s3.iter_json(client, "responses.json")) == s3.get_json(
+        client, "responses.json"
+    )
+
+
+def test_digest_of_parsed_responses_is_that_of_the_list(client):
+    s3.put_json(client, "responses.json", RESPONSES)
+    digest = hash_of_json(
+        [
+            {"docs": r["response"]["docs"], "highlighting": r.get("highlighting")}
+            for r in RESPONSES
+        ]
+    )
+    assert digest_of_responses(s3.iter_json(client, "responses.json")) == digest
@@ -0,0 +1,23 @@
+"""Helpers in `ads_query_eval.lib.util`."""
+import sys
+
+from ads_query_eval.lib.util import LRUCache, memory_size_of
+
+
+def test_memory_size_of_counts_containers_and_shared_objects_once():
+    html = "<li>" + "x" * 10_000 + "</li>"
+    items = [{"bibcode": "2021LRSP...18....3V", "html": html}] * 2
+    size = memory_size_of(items)
+    assert size > sys.getsizeof(html) + sys.getsizeof(items) + sys.getsizeof(items[0])
+    assert size < 2 * sys.getsizeof(html)
+
+
+def test_cache_weighed_by_memory_size_evicts_least_recently_used():
+    def items():
+        return [{"html": "x" * 1000}]
+
+    cache = LRUCache(maxsize=2 * memory_size_of(items()), weigh=memory_size_of)
+    for key in ("a", "b", "c"):
+        cache.set(key, items())
+    assert cache.get("a") is None
+    assert cache.get("b") == cache.get("c") == items()